@@ -17,7 +17,6 @@
     'external_dependencies': {
         'python': [
             'schema',
-            'pypeg2',
         ],
     },
     'data': [
@@ -1,9 +1,10 @@
 import logging
 
 from odoo.http import request
-from odoo import SUPERUSER_ID
+from odoo import fields
 
 from .http import JsonApiException
+from .metrics import measure
 
 _logger = logging.getLogger(__name__)
 
@@ -14,23 +15,33 @@ class ApiAuthentification(object):
         """
         API key authentication check
         """
+        with measure('auth'):
+            return self._auth_api_key()
+
+    @classmethod
+    def _auth_api_key(self):
         received_api_key = request.httprequest.environ.get(
             'HTTP_X_ODOO_API_KEY')
-        api_handler_env = request.env['pcv.api.handler'].sudo()
-        configuration_api_key = api_handler_env.search(
-            [('incoming_api_key', '=', received_api_key)])
+        credentials = None
+        if received_api_key:
+            credentials = request.env[
+                'pcv.api.handler']._get_api_key_credentials(received_api_key)
 
         _logger.debug(
             'Check API keys - Recieved: %s -- Source: %s' % (
-                received_api_key, configuration_api_key))
-        if not configuration_api_key:
+                received_api_key, credentials))
+        if not credentials or not credentials.active:
             raise JsonApiException(
                 msg='Failed authentification',
                 hint='Check your API key',
                 code=401,
             )
-        if configuration_api_key.root_user:
-            uid = SUPERUSER_ID
-        else:
-            uid = configuration_api_key.user_id.id
-        request.uid = uid
+        if credentials.expire_date \
+                and credentials.expire_date < fields.Datetime.now():
+            raise JsonApiException(
+                msg='Failed authentification',
+                hint='Your API key has expired',
+                code=401,
+            )
+        request.uid = credentials.uid
+        return credentials
@@ -0,0 +1,408 @@
+"""
+Pure Python MessagePack (https://msgpack.org/) and CBOR (RFC 8949)
+encoders and decoders, used when the msgpack and cbor2 packages are not
+installed. They handle the data model of JSON: None, booleans, integers,
+floats, strings, lists and dicts, plus bytes; any other value is encoded
+as what `default` returns for it.
+
+Integers over 64 bits are bignums, as the JSON numbers have no limit: the
+big-endian bytes of the value, or of -1 - value for a negative one, in
+the CBOR tags 2 and 3 and in the MessagePack extension types
+MSGPACK_BIGNUM_EXT and MSGPACK_NEGATIVE_BIGNUM_EXT.
+"""
+import struct
+
+# MessagePack
+
+_MSGPACK_UINTS = (
+    (0xff, struct.Struct('>BB'), 0xcc),
+    (0xffff, struct.Struct('>BH'), 0xcd),
+    (0xffffffff, struct.Struct('>BI'), 0xce),
+    (0xffffffffffffffff, struct.Struct('>BQ'), 0xcf),
+)
+_MSGPACK_INTS = (
+    (-0x80, struct.Struct('>Bb'), 0xd0),
+    (-0x8000, struct.Struct('>Bh'), 0xd1),
+    (-0x80000000, struct.Struct('>Bi'), 0xd2),
+    (-0x8000000000000000, struct.Struct('>Bq'), 0xd3),
+)
+_MSGPACK_FLOAT = struct.Struct('>Bd')
+# Extension types of the integers over 64 bits, as the CBOR tags
+MSGPACK_BIGNUM_EXT = 2
+MSGPACK_NEGATIVE_BIGNUM_EXT = 3
+# (maximum length, header, code) of the strings, bytes, arrays and maps
+_MSGPACK_STR = ((0xff, '>BB', 0xd9), (0xffff, '>BH', 0xda), (0xffffffff, '>BI', 0xdb))
+_MSGPACK_BIN = ((0xff, '>BB', 0xc4), (0xffff, '>BH', 0xc5), (0xffffffff, '>BI', 0xc6))
+_MSGPACK_ARRAY = ((0xffff, '>BH', 0xdc), (0xffffffff, '>BI', 0xdd))
+_MSGPACK_MAP = ((0xffff, '>BH', 0xde), (0xffffffff, '>BI', 0xdf))
+_MSGPACK_EXT = ((0xff, '>BBb', 0xc7), (0xffff, '>BHb', 0xc8), (0xffffffff, '>BIb', 0xc9))
+
+# Code of the fixed size values: struct of the value
+_MSGPACK_NUMBERS = {
+    0xca: struct.Struct('>f'),
+    0xcb: struct.Struct('>d'),
+    0xcc: struct.Struct('>B'),
+    0xcd: struct.Struct('>H'),
+    0xce: struct.Struct('>I'),
+    0xcf: struct.Struct('>Q'),
+    0xd0: struct.Struct('>b'),
+    0xd1: struct.Struct('>h'),
+    0xd2: struct.Struct('>i'),
+    0xd3: struct.Struct('>q'),
+}
+# Code of the sized values: (struct of the size, kind)
+_MSGPACK_SIZES = {
+    0xc4: (struct.Struct('>B'), 'bin'),
+    0xc5: (struct.Struct('>H'), 'bin'),
+    0xc6: (struct.Struct('>I'), 'bin'),
+    0xd9: (struct.Struct('>B'), 'str'),
+    0xda: (struct.Struct('>H'), 'str'),
+    0xdb: (struct.Struct('>I'), 'str'),
+    0xdc: (struct.Struct('>H'), 'array'),
+    0xdd: (struct.Struct('>I'), 'array'),
+    0xde: (struct.Struct('>H'), 'map'),
+    0xdf: (struct.Struct('>I'), 'map'),
+    0xc7: (struct.Struct('>B'), 'ext'),
+    0xc8: (struct.Struct('>H'), 'ext'),
+    0xc9: (struct.Struct('>I'), 'ext'),
+}
+# Code of the fixext values: size
+_MSGPACK_FIXEXT = {0xd4: 1, 0xd5: 2, 0xd6: 4, 0xd7: 8, 0xd8: 16}
+_MSGPACK_EXT_TYPE = struct.Struct('>b')
+
+
+def _msgpack_header(length, fix_code, fix_max, formats, write):
+    if length <= fix_max:
+        write(bytes((fix_code | length,)))
+        return
+    for max_length, header, code in formats:
+        if length <= max_length:
+            write(struct.pack(header, code, length))
+            return
+    raise ValueError('Value too long for MessagePack: %s' % length)
+
+
+def _msgpack_pack(obj, write, default):
+    if obj is None:
+        write(b'\xc0')
+    elif obj is True:
+        write(b'\xc3')
+    elif obj is False:
+        write(b'\xc2')
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            write(bytes((obj,)))
+        elif -0x20 <= obj < 0:
+            write(bytes((obj + 0x100,)))
+        elif obj > 0:
+            for max_value, packer, code in _MSGPACK_UINTS:
+                if obj <= max_value:
+                    write(packer.pack(code, obj))
+                    return
+            _msgpack_pack_bignum(obj, write)
+        else:
+            for min_value, packer, code in _MSGPACK_INTS:
+                if obj >= min_value:
+                    write(packer.pack(code, obj))
+                    return
+            _msgpack_pack_bignum(obj, write)
+    elif isinstance(obj, float):
+        write(_MSGPACK_FLOAT.pack(0xcb, obj))
+    elif isinstance(obj, str):
+        data = obj.encode('utf-8', 'surrogatepass')
+        _msgpack_header(len(data), 0xa0, 31, _MSGPACK_STR, write)
+        write(data)
+    elif isinstance(obj, (list, tuple)):
+        _msgpack_header(len(obj), 0x90, 15, _MSGPACK_ARRAY, write)
+        for item in obj:
+            _msgpack_pack(item, write, default)
+    elif isinstance(obj, dict):
+        _msgpack_header(len(obj), 0x80, 15, _MSGPACK_MAP, write)
+        for key, value in obj.items():
+            _msgpack_pack(key, write, default)
+            _msgpack_pack(value, write, default)
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        data = bytes(obj)
+        # bin has no fix format
+        _msgpack_header(len(data), 0, -1, _MSGPACK_BIN, write)
+        write(data)
+    else:
+        _msgpack_pack(default(obj), write, default)
+
+
+def _msgpack_pack_bignum(obj, write):
+    ext_type, value = (
+        (MSGPACK_BIGNUM_EXT, obj) if obj >= 0
+        else (MSGPACK_NEGATIVE_BIGNUM_EXT, -1 - obj))
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    for max_length, header, code in _MSGPACK_EXT:
+        if len(data) <= max_length:
+            write(struct.pack(header, code, len(data), ext_type))
+            write(data)
+            return
+    raise ValueError('Integer too long for MessagePack')
+
+
+def msgpack_ext_to_int(ext_type, data):
+    """The integer of a bignum extension, raise ValueError for other types."""
+    if ext_type == MSGPACK_BIGNUM_EXT:
+        return int.from_bytes(data, 'big')
+    if ext_type == MSGPACK_NEGATIVE_BIGNUM_EXT:
+        return -1 - int.from_bytes(data, 'big')
+    raise ValueError('Unsupported MessagePack extension type %s' % ext_type)
+
+
+def msgpack_dumps(obj, default=str):
+    """Return the MessagePack bytes of `obj`."""
+    chunks = []
+    _msgpack_pack(obj, chunks.append, default)
+    return b''.join(chunks)
+
+
+class _Decoder(object):
+
+    def __init__(self, data):
+        self.data = bytes(data)
+        self.pos = 0
+
+    def read_byte(self):
+        byte = self.data[self.pos]
+        self.pos += 1
+        return byte
+
+    def read_struct(self, unpacker):
+        value = unpacker.unpack_from(self.data, self.pos)[0]
+        self.pos += unpacker.size
+        return value
+
+    def read_bytes(self, length):
+        end = self.pos + length
+        if end > len(self.data):
+            raise ValueError('Truncated data')
+        data = self.data[self.pos:end]
+        self.pos = end
+        return data
+
+    def peek_byte(self):
+        return self.data[self.pos]
+
+
+class _MsgpackDecoder(_Decoder):
+
+    def decode(self):
+        code = self.read_byte()
+        if code <= 0x7f:
+            return code
+        if code >= 0xe0:
+            return code - 0x100
+        if code <= 0x8f:
+            return self.decode_map(code & 0x0f)
+        if code <= 0x9f:
+            return self.decode_array(code & 0x0f)
+        if code <= 0xbf:
+            return self.read_bytes(code & 0x1f).decode('utf-8', 'surrogatepass')
+        if code == 0xc0:
+            return None
+        if code == 0xc2:
+            return False
+        if code == 0xc3:
+            return True
+        if code in _MSGPACK_NUMBERS:
+            return self.read_struct(_MSGPACK_NUMBERS[code])
+        if code in _MSGPACK_FIXEXT:
+            return self.decode_ext(_MSGPACK_FIXEXT[code])
+        if code in _MSGPACK_SIZES:
+            unpacker, kind = _MSGPACK_SIZES[code]
+            length = self.read_struct(unpacker)
+            if kind == 'str':
+                return self.read_bytes(length).decode('utf-8', 'surrogatepass')
+            if kind == 'bin':
+                return self.read_bytes(length)
+            if kind == 'ext':
+                return self.decode_ext(length)
+            if kind == 'array':
+                return self.decode_array(length)
+            return self.decode_map(length)
+        raise ValueError('Unsupported MessagePack type 0x%02x' % code)
+
+    def decode_array(self, length):
+        return [self.decode() for i in range(length)]
+
+    def decode_ext(self, length):
+        ext_type = self.read_struct(_MSGPACK_EXT_TYPE)
+        return msgpack_ext_to_int(ext_type, self.read_bytes(length))
+
+    def decode_map(self, length):
+        result = {}
+        for i in range(length):
+            key = self.decode()
+            result[key] = self.decode()
+        return result
+
+
+def msgpack_loads(data):
+    """Return the value of MessagePack bytes, raise ValueError if they are invalid."""
+    return _loads(_MsgpackDecoder(data), 'MessagePack')
+
+
+# CBOR
+
+_CBOR_ARGUMENTS = {
+    24: struct.Struct('>B'),
+    25: struct.Struct('>H'),
+    26: struct.Struct('>I'),
+    27: struct.Struct('>Q'),
+}
+_CBOR_FLOATS = {
+    25: struct.Struct('>e'),
+    26: struct.Struct('>f'),
+    27: struct.Struct('>d'),
+}
+_CBOR_FLOAT = struct.Struct('>Bd')
+_CBOR_BREAK = 0xff
+
+
+def _cbor_head(major, argument, write):
+    major <<= 5
+    if argument < 24:
+        write(bytes((major | argument,)))
+    elif argument <= 0xff:
+        write(bytes((major | 24, argument)))
+    elif argument <= 0xffff:
+        write(struct.pack('>BH', major | 25, argument))
+    elif argument <= 0xffffffff:
+        write(struct.pack('>BI', major | 26, argument))
+    else:
+        write(struct.pack('>BQ', major | 27, argument))
+
+
+def _cbor_pack(obj, write, default):
+    if obj is None:
+        write(b'\xf6')
+    elif obj is True:
+        write(b'\xf5')
+    elif obj is False:
+        write(b'\xf4')
+    elif isinstance(obj, int):
+        major, value = (0, obj) if obj >= 0 else (1, -1 - obj)
+        if value <= 0xffffffffffffffff:
+            _cbor_head(major, value, write)
+        else:
+            # Bignum, tag 2 or 3
+            data = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+            _cbor_head(6, 2 + major, write)
+            _cbor_head(2, len(data), write)
+            write(data)
+    elif isinstance(obj, float):
+        write(_CBOR_FLOAT.pack(0xfb, obj))
+    elif isinstance(obj, str):
+        data = obj.encode('utf-8', 'surrogatepass')
+        _cbor_head(3, len(data), write)
+        write(data)
+    elif isinstance(obj, (list, tuple)):
+        _cbor_head(4, len(obj), write)
+        for item in obj:
+            _cbor_pack(item, write, default)
+    elif isinstance(obj, dict):
+        _cbor_head(5, len(obj), write)
+        for key, value in obj.items():
+            _cbor_pack(key, write, default)
+            _cbor_pack(value, write, default)
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        data = bytes(obj)
+        _cbor_head(2, len(data), write)
+        write(data)
+    else:
+        _cbor_pack(default(obj), write, default)
+
+
+def cbor_dumps(obj, default=str):
+    """Return the CBOR bytes of `obj`."""
+    chunks = []
+    _cbor_pack(obj, chunks.append, default)
+    return b''.join(chunks)
+
+
+class _CborDecoder(_Decoder):
+
+    def decode(self):
+        initial = self.read_byte()
+        major, info = initial >> 5, initial & 0x1f
+        if major == 7:
+            return self.decode_simple(info)
+        if info == 31:
+            return self.decode_indefinite(major)
+        if info < 24:
+            argument = info
+        elif info in _CBOR_ARGUMENTS:
+            argument = self.read_struct(_CBOR_ARGUMENTS[info])
+        else:
+            raise ValueError('Invalid CBOR argument %s' % info)
+
+        if major == 0:
+            return argument
+        if major == 1:
+            return -1 - argument
+        if major == 2:
+            return self.read_bytes(argument)
+        if major == 3:
+            return self.read_bytes(argument).decode('utf-8', 'surrogatepass')
+        if major == 4:
+            return [self.decode() for i in range(argument)]
+        if major == 5:
+            result = {}
+            for i in range(argument):
+                key = self.decode()
+                result[key] = self.decode()
+            return result
+        # Tags, only the bignums change the value
+        value = self.decode()
+        if argument in (2, 3) and isinstance(value, bytes):
+            value = int.from_bytes(value, 'big')
+            return value if argument == 2 else -1 - value
+        return value
+
+    def decode_simple(self, info):
+        if info == 20:
+            return False
+        if info == 21:
+            return True
+        if info in (22, 23):
+            # null and undefined
+            return None
+        if info in _CBOR_FLOATS:
+            return self.read_struct(_CBOR_FLOATS[info])
+        raise ValueError('Unsupported CBOR simple value %s' % info)
+
+    def decode_indefinite(self, major):
+        items = []
+        while self.peek_byte() != _CBOR_BREAK:
+            items.append(self.decode())
+        self.pos += 1
+        if major == 2:
+            return b''.join(items)
+        if major == 3:
+            return ''.join(items)
+        if major == 4:
+            return items
+        if major == 5:
+            if len(items) % 2:
+                raise ValueError('Odd number of items in a CBOR map')
+            return dict(zip(items[::2], items[1::2]))
+        raise ValueError('Invalid indefinite length CBOR item')
+
+
+def cbor_loads(data):
+    """Return the value of CBOR bytes, raise ValueError if they are invalid."""
+    return _loads(_CborDecoder(data), 'CBOR')
+
+
+def _loads(decoder, name):
+    try:
+        value = decoder.decode()
+    except (IndexError, TypeError, struct.error, RecursionError) as e:
+        # Truncated data, unhashable keys or too deep nesting
+        raise ValueError('Invalid %s data: %s' % (name, e))
+    if decoder.pos != len(decoder.data):
+        raise ValueError('Invalid %s data: extra data' % name)
+    return value
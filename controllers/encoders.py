@@ -0,0 +1,205 @@
+import json
+import logging
+from collections import OrderedDict, namedtuple
+from datetime import date, datetime
+
+from odoo.tools import config, ustr, DEFAULT_SERVER_DATE_FORMAT, DEFAULT_SERVER_DATETIME_FORMAT
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+from . import binary_codecs
+
+_logger = logging.getLogger(__name__)
+
+# Odoo configuration option forcing the JSON encoder, one of ENCODERS
+ENCODER_OPTION = 'kuw_api_json_encoder'
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+CBOR_MIMETYPE = 'application/cbor'
+
+
+def json_default(obj):
+    """
+    Properly serializes date and datetime objects, in the Odoo server
+    formats, and anything else as text.
+    """
+    if isinstance(obj, datetime):
+        return obj.strftime(DEFAULT_SERVER_DATETIME_FORMAT)
+    if isinstance(obj, date):
+        return obj.strftime(DEFAULT_SERVER_DATE_FORMAT)
+    return ustr(obj)
+
+
+def encode_stdlib(obj):
+    try:
+        data = json.dumps(
+            obj, default=json_default, ensure_ascii=False, separators=(',', ':'))
+        return data.encode('utf-8')
+    except UnicodeEncodeError:
+        # Lone surrogates can only be sent escaped
+        return json.dumps(
+            obj, default=json_default, separators=(',', ':')).encode('utf-8')
+
+
+if orjson is not None:
+    # Dates go through json_default to keep the Odoo server formats
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def encode_orjson(obj):
+        try:
+            return orjson.dumps(obj, default=json_default, option=ORJSON_OPTIONS)
+        except TypeError:
+            # Integers over 64 bits, lone surrogates...
+            return encode_stdlib(obj)
+
+
+def _ujson_supports_default():
+    try:
+        return ujson.dumps(date(2000, 1, 1), default=str) == '"2000-01-01"'
+    except Exception:
+        return False
+
+
+if ujson is not None and _ujson_supports_default():
+
+    def encode_ujson(obj):
+        try:
+            return ujson.dumps(
+                obj, default=json_default, ensure_ascii=False).encode('utf-8')
+        except (TypeError, ValueError, OverflowError, UnicodeEncodeError):
+            return encode_stdlib(obj)
+else:
+    ujson = None
+
+
+# Encoders of a value to JSON UTF-8 bytes, the fastest one first
+ENCODERS = OrderedDict()
+if orjson is not None:
+    ENCODERS['orjson'] = encode_orjson
+if ujson is not None:
+    ENCODERS['ujson'] = encode_ujson
+ENCODERS['json'] = encode_stdlib
+
+
+_encoder = None
+
+
+def register_encoder(name, encode, first=False):
+    """Add an encoder, a function returning the JSON UTF-8 bytes of a value."""
+    global _encoder
+    ENCODERS[name] = encode
+    if first:
+        ENCODERS.move_to_end(name, last=False)
+    _encoder = None
+
+
+def get_encoder():
+    """The encoder set by the kuw_api_json_encoder option, else the fastest one."""
+    global _encoder
+    if _encoder is None:
+        name = config.get(ENCODER_OPTION)
+        if name and name not in ENCODERS:
+            _logger.warning(
+                'Unknown JSON encoder %s, using %s', name, next(iter(ENCODERS)))
+        _encoder = ENCODERS.get(name) or next(iter(ENCODERS.values()))
+    return _encoder
+
+
+def encode_json(obj):
+    """Return the JSON of `obj` as UTF-8 bytes."""
+    return get_encoder()(obj)
+
+
+def decode_json(data):
+    return json.loads(data)
+
+
+# MessagePack and CBOR carry the same values as the JSON: dates are the
+# strings of json_default, tuples are arrays. The C packages are used
+# when they are installed, else binary_codecs.
+
+def encode_msgpack_python(obj):
+    return binary_codecs.msgpack_dumps(obj, default=json_default)
+
+
+if msgpack is not None and msgpack.version >= (1, 0):
+
+    def encode_msgpack(obj):
+        try:
+            return msgpack.packb(
+                obj, default=json_default, use_bin_type=True,
+                unicode_errors='surrogatepass')
+        except (OverflowError, ValueError):
+            # Integers over 64 bits, sent as bignum extensions
+            return encode_msgpack_python(obj)
+
+    def decode_msgpack(data):
+        try:
+            return msgpack.unpackb(
+                data, raw=False, strict_map_key=False,
+                unicode_errors='surrogatepass',
+                ext_hook=binary_codecs.msgpack_ext_to_int)
+        except (ValueError, TypeError) as e:
+            raise ValueError(str(e))
+else:
+    encode_msgpack = encode_msgpack_python
+    decode_msgpack = binary_codecs.msgpack_loads
+
+
+# cbor2 writes dates as CBOR tags, the encoding is always the Python one
+def encode_cbor(obj):
+    return binary_codecs.cbor_dumps(obj, default=json_default)
+
+
+if cbor2 is not None:
+
+    def decode_cbor(data):
+        try:
+            return cbor2.loads(data)
+        except (ValueError, TypeError) as e:
+            raise ValueError(str(e))
+else:
+    decode_cbor = binary_codecs.cbor_loads
+
+
+MediaType = namedtuple('MediaType', ['encode', 'decode'])
+
+# Media types of the request and response bodies, the default one first
+MEDIA_TYPES = OrderedDict([
+    (JSON_MIMETYPE, MediaType(encode_json, decode_json)),
+    (MSGPACK_MIMETYPE, MediaType(encode_msgpack, decode_msgpack)),
+    ('application/x-msgpack', MediaType(encode_msgpack, decode_msgpack)),
+    (CBOR_MIMETYPE, MediaType(encode_cbor, decode_cbor)),
+])
+
+
+def negotiate_mimetype(accept_mimetypes):
+    """
+    The media type of MEDIA_TYPES preferred by the Accept header parsed
+    in `accept_mimetypes`, JSON when it accepts none or anything.
+    """
+    return accept_mimetypes.best_match(list(MEDIA_TYPES), default=JSON_MIMETYPE)
+
+
+def encode_body(obj, mimetype=JSON_MIMETYPE):
+    """Return `obj` encoded in the media type `mimetype` of MEDIA_TYPES."""
+    return MEDIA_TYPES[mimetype].encode(obj)
@@ -1,7 +1,6 @@
 import json
 import logging
 import traceback
-from datetime import date, datetime
 from collections import OrderedDict
 
 from odoo import http
@@ -11,19 +10,18 @@ from odoo.exceptions import UserError
 
 import werkzeug.exceptions as Wexception
 
+from .encoders import (
+    JSON_MIMETYPE, MEDIA_TYPES, encode_body, negotiate_mimetype)
+from .metrics import measure
+
 _logger = logging.getLogger(__name__)
 
 
-def json_default(obj):
-    """
-    Properly serializes date and datetime objects.
-    """
-    from odoo import fields
-    if isinstance(obj, datetime):
-        return fields.Datetime.to_string(obj)
-    if isinstance(obj, date):
-        return fields.Date.to_string(obj)
-    return ustr(obj)
+def get_response_mimetype():
+    """The media type of the response body, negotiated from the Accept header."""
+    if not http.request:
+        return JSON_MIMETYPE
+    return negotiate_mimetype(http.request.httprequest.accept_mimetypes)
 
 
 class JsonApiException(Exception):
@@ -43,6 +41,8 @@ class JsonApiResponse():
         self.result = result
         self.http_code = http_code
         self._status_code = http_code
+        self._body = None
+        self._body_mimetype = None
 
     def serialize(self) -> OrderedDict:
         response = OrderedDict([
@@ -60,6 +60,19 @@ class JsonApiResponse():
 
         return response
 
+    def get_body(self, mimetype=None) -> bytes:
+        """
+        Return the body of the response in `mimetype`, by default the one
+        negotiated with the client, encoded only once so that api_route
+        can measure it before it is sent.
+        """
+        mimetype = mimetype or get_response_mimetype()
+        if self._body is None or self._body_mimetype != mimetype:
+            with measure('encode'):
+                self._body = encode_body(self.serialize(), mimetype)
+            self._body_mimetype = mimetype
+        return self._body
+
 
 class HttpJsonApiResponse():
     @staticmethod
@@ -79,14 +92,19 @@ class HttpJsonApiResponse():
                 'exception_type': type(error).__name__,
             }
 
+        mimetype = get_response_mimetype()
+        with measure('encode'):
+            body = encode_body(resp, mimetype)
         return http.Response(
-            json.dumps(resp, default=json_default),
+            body,
             status=code,
-            mimetype='application/json',
+            mimetype=mimetype,
         )
 
     @staticmethod
-    def success_response(data, meta=None):
+    def success_response(data, meta=None, etag=None, last_modified=None,
+                         mimetype=None):
+        mimetype = mimetype or get_response_mimetype()
         resp = OrderedDict([
             ('status', 'success'),
             ('result', data),
@@ -95,19 +113,58 @@ class HttpJsonApiResponse():
         if meta:
             resp['meta'] = meta
 
+        with measure('encode'):
+            body = encode_body(resp, mimetype)
+        return HttpJsonApiResponse.body_response(
+            body, etag=etag, last_modified=last_modified, mimetype=mimetype)
+
+    @staticmethod
+    def body_response(body, code=200, etag=None, last_modified=None,
+                      mimetype=None):
+        """Response of an already encoded body, by default in the negotiated media type."""
+        response = http.Response(
+            body,
+            status=code,
+            mimetype=mimetype or get_response_mimetype(),
+        )
+        HttpJsonApiResponse.set_validators(response, etag, last_modified)
+        return response
+
+    @staticmethod
+    def stream_response(chunks, mimetype):
+        """Chunked response of the bytes yielded by `chunks`."""
         return http.Response(
-            json.dumps(resp, default=json_default),
+            chunks,
             status=200,
-            mimetype='application/json',
+            mimetype=mimetype,
+            direct_passthrough=True,
         )
 
+    @staticmethod
+    def not_modified_response(etag=None, last_modified=None):
+        """Empty 304 response, the client reuses the body it has."""
+        response = http.Response(status=304)
+        HttpJsonApiResponse.set_validators(response, etag, last_modified)
+        return response
+
+    @staticmethod
+    def set_validators(response, etag=None, last_modified=None):
+        # The body depends on the Accept header
+        response.vary.add('Accept')
+        if etag:
+            response.set_etag(etag)
+        if last_modified:
+            response.last_modified = last_modified
+
 
 class JsonRequestNew(JsonRequest):
     """
     Overide of the JsonRequest
     Adding the fact that Input of json API can be an array
     ex: [{"aa":"bb"}]
-    and that the output of the response can be also anything
+    and that the output of the response can be also anything.
+    The body can also be MessagePack or CBOR, following its Content-Type,
+    and the response is in the media type preferred by the Accept header.
     """
 
     def __init__(self, *args):
@@ -117,14 +174,24 @@ class JsonRequestNew(JsonRequest):
         args = self.httprequest.args
         request = None
 
-        request = self.httprequest.get_data().decode(self.httprequest.charset)
+        mimetype = self.httprequest.mimetype
+        if mimetype in BINARY_MIMETYPES:
+            request = self.httprequest.get_data()
+            try:
+                self.jsonrequest = MEDIA_TYPES[mimetype].decode(request)
+            except ValueError as e:
+                msg = 'Invalid %s data: %s' % (mimetype, e)
+                _logger.info('%s: %s', self.httprequest.path, msg)
+                raise Wexception.BadRequest(msg)
+        else:
+            request = self.httprequest.get_data().decode(self.httprequest.charset)
 
-        try:
-            self.jsonrequest = json.loads(request)
-        except ValueError:
-            msg = 'Invalid JSON data: %r' % (request,)
-            _logger.info('%s: %s', self.httprequest.path, msg)
-            raise Wexception.BadRequest(msg)
+            try:
+                self.jsonrequest = json.loads(request)
+            except ValueError:
+                msg = 'Invalid JSON data: %r' % (request,)
+                _logger.info('%s: %s', self.httprequest.path, msg)
+                raise Wexception.BadRequest(msg)
 
         if isinstance(self.jsonrequest, dict):
             self.params = dict(self.jsonrequest.get('params', {}))
@@ -135,22 +202,23 @@ class JsonRequestNew(JsonRequest):
             self.context = dict(self.session.context)
 
     def _json_response(self, result=None, error=None):
-        response = None
         status = None
         if isinstance(self.jsonrequest, dict):
             request_id = self.jsonrequest.get('id')
         else:
             request_id = None
 
+        mime = negotiate_mimetype(self.httprequest.accept_mimetypes)
+        body = None
         if error is not None and isinstance(error, JsonApiResponse):
-            response = error.serialize()
+            body = error.get_body(mime)
             status = error.http_code
 
         if isinstance(result, JsonApiResponse):
-            response = result.serialize()
+            body = result.get_body(mime)
             status = result.http_code
 
-        if not response:
+        if body is None:
             response = {
                 'jsonrpc': '2.0',
                 'id': request_id,
@@ -161,13 +229,16 @@ class JsonRequestNew(JsonRequest):
             if result is not None:
                 response['result'] = result
 
-        mime = 'application/json'
-        body = json.dumps(response, default=json_default)
+            body = encode_body(response, mime)
+
+        headers = [('Content-Type', mime), ('Content-Length', len(body))]
+        # Server-Timing of the route, see api_route
+        headers.extend(getattr(self, 'api_response_headers', []))
 
         return Response(
             body, status=status or (error and error.pop(
                 'http_status', 200)) or 200,
-            headers=[('Content-Type', mime), ('Content-Length', len(body))],
+            headers=headers,
         )
 
     def _handle_exception(self, exception):
@@ -213,5 +284,19 @@ class JsonRequestNew(JsonRequest):
             return self._json_response(error=error)
 
 
+# Bodies Odoo would not read as JSON requests
+BINARY_MIMETYPES = frozenset(MEDIA_TYPES) - {JSON_MIMETYPE}
+
+_get_request = http.Root.get_request
+
+
+def get_request(self, httprequest):
+    """The MessagePack and CBOR bodies are JSON requests as well."""
+    if httprequest.mimetype in BINARY_MIMETYPES:
+        return http.JsonRequest(httprequest)
+    return _get_request(self, httprequest)
+
+
 _logger.info('monkey patching http.JsonRequest')
 http.JsonRequest = JsonRequestNew
+http.Root.get_request = get_request
@@ -0,0 +1,147 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+from datetime import datetime
+
+from odoo import registry
+
+_logger = logging.getLogger(__name__)
+
+# Maximum number of log entries waiting to be written, the next ones are
+# dropped and counted
+LOG_QUEUE_SIZE = 10000
+# Maximum number of log entries written by one INSERT
+LOG_BATCH_SIZE = 500
+# Seconds between two flushes of the buffer
+LOG_FLUSH_INTERVAL = 1.0
+
+# Columns of pcv_api_handler_log written by the buffer
+LOG_COLUMNS = [
+    'create_date',
+    'api_endpoint',
+    'request_received',
+    'state',
+    'message',
+    'api_handler_id',
+    'duration',
+    'auth_duration',
+    'search_duration',
+    'serialize_duration',
+    'query_count',
+    'response_size',
+    'row_count',
+]
+
+
+class RequestLogBuffer(object):
+    """
+    Per-process buffer of the API request logs. The requests only queue
+    their log entry, a background thread writes them by batches.
+    """
+
+    def __init__(self, maxsize=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE,
+                 interval=LOG_FLUSH_INTERVAL):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.interval = interval
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._stopping = None
+
+    def append(self, dbname, vals):
+        """Queue a log entry, `vals` being the values of LOG_COLUMNS."""
+        self._ensure_started()
+        vals.setdefault('create_date', datetime.utcnow())
+        entry = (dbname, tuple(vals.get(column) for column in LOG_COLUMNS))
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _ensure_started(self):
+        # The thread of the parent process does not survive a fork, each
+        # prefork worker starts its own one.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.maxsize)
+            self._stopping = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run,
+                name='kuw_api.request_log',
+                daemon=True,
+            )
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.flush()
+
+    def stop(self):
+        """Stop the background thread and write the pending entries."""
+        if self._pid != os.getpid():
+            return
+        self._stopping.set()
+        self._thread.join(self.interval * 2)
+        self.flush()
+
+    def flush(self):
+        while True:
+            entries = []
+            try:
+                while len(entries) < self.batch_size:
+                    entries.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not entries:
+                break
+            self._write(entries)
+
+        if self.dropped != self._reported_dropped:
+            _logger.warning(
+                '%s API request log entries dropped',
+                self.dropped - self._reported_dropped)
+            self._reported_dropped = self.dropped
+
+    def _write(self, entries):
+        entries_by_db = {}
+        for entry in entries:
+            entries_by_db.setdefault(entry[0], []).append(entry[1])
+
+        for dbname, rows in entries_by_db.items():
+            for attempt in range(2):
+                try:
+                    with registry(dbname).cursor() as cr:
+                        self._insert(cr, rows)
+                    break
+                except Exception:
+                    if attempt:
+                        _logger.exception(
+                            'Could not write %s API request log entries',
+                            len(rows))
+                        with self._lock:
+                            self.dropped += len(rows)
+
+    @staticmethod
+    def _insert(cr, rows):
+        placeholders = '(%s)' % ', '.join(['%s'] * len(LOG_COLUMNS))
+        values = ', '.join(
+            cr.mogrify(placeholders, row).decode()
+            for row in rows
+        )
+        cr.execute('INSERT INTO pcv_api_handler_log (%s) VALUES %s' % (
+            ', '.join(LOG_COLUMNS), values))
+
+
+request_log_buffer = RequestLogBuffer()
+atexit.register(request_log_buffer.stop)
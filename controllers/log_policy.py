@@ -0,0 +1,61 @@
+import base64
+import hashlib
+import random
+import zlib
+from collections import namedtuple
+
+COMPRESSED_PREFIX = 'zlib:'
+HASHED_PREFIX = 'sha256:'
+
+
+class LogPolicy(namedtuple('LogPolicy', ['payload', 'max_size', 'success_rate', 'compress'])):
+    """
+    How the requests of an API key are logged:
+    payload       'full' to store the payload, 'hash' to store its
+                  SHA-256, 'none' to store nothing,
+    max_size      maximum number of bytes of payload stored, 0 for no limit,
+    success_rate  part of the successful requests logged, between 0 and 1.
+                  Failures are always logged,
+    compress      store the payload zlib compressed.
+    """
+    __slots__ = ()
+
+    def must_log(self, success=True):
+        if not success or self.success_rate >= 1:
+            return True
+        return random.random() < self.success_rate
+
+    def format_payload(self, httprequest, params):
+        """
+        Return the payload to store for a request. json requests store
+        their body, http requests their parameters.
+        """
+        if self.payload == 'none':
+            return None
+
+        data = httprequest.get_data()
+        if self.payload == 'hash':
+            return HASHED_PREFIX + hashlib.sha256(
+                data or httprequest.query_string).hexdigest()
+
+        if not data:
+            data = str(params).encode()
+        size = len(data)
+        if self.max_size and size > self.max_size:
+            data = data[:self.max_size] + (
+                '... [truncated, %s bytes]' % size).encode()
+        if self.compress:
+            return COMPRESSED_PREFIX + base64.b64encode(
+                zlib.compress(data)).decode()
+        return data.decode('utf-8', errors='replace')
+
+
+DEFAULT_LOG_POLICY = LogPolicy('full', 0, 1.0, False)
+
+
+def decode_payload(value):
+    """Return the readable form of a payload stored by format_payload."""
+    if value and value.startswith(COMPRESSED_PREFIX):
+        data = base64.b64decode(value[len(COMPRESSED_PREFIX):])
+        return zlib.decompress(data).decode('utf-8', errors='replace')
+    return value
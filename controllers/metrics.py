@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+def _thread_query_count():
+    # Odoo counts the SQL queries of the request thread
+    return getattr(threading.current_thread(), 'query_count', 0)
+
+
+def new_span_id():
+    return os.urandom(8).hex()
+
+
+def new_trace_id():
+    return os.urandom(16).hex()
+
+
+class Span(object):
+    """A timed operation of a request, in the shape of an OpenTelemetry span."""
+    __slots__ = ('name', 'span_id', 'parent_id', 'start_time', 'end_time',
+                 '_start', 'duration', 'attributes', 'error')
+
+    def __init__(self, name, parent_id=None, attributes=None):
+        self.name = name
+        self.span_id = new_span_id()
+        self.parent_id = parent_id
+        self.attributes = attributes or {}
+        self.error = None
+        self.start_time = time.time_ns()
+        self.end_time = None
+        self._start = time.perf_counter()
+        self.duration = None
+
+    def end(self):
+        self.duration = time.perf_counter() - self._start
+        self.end_time = self.start_time + int(self.duration * 1e9)
+
+
+class RequestMetrics(object):
+    """
+    Performance figures of the API request processed by the current
+    thread: the spans of the request, the time spent by span name and
+    counters. Durations are in seconds.
+    """
+
+    def __init__(self, trace_id=None, parent_id=None, attributes=None):
+        self.trace_id = trace_id or new_trace_id()
+        self.root = Span('request', parent_id, attributes)
+        self.spans = [self.root]
+        self._stack = [self.root]
+        self.started_at = self.root._start
+        self.durations = {}
+        self.row_count = None
+        self.response_size = None
+        self._query_count_start = _thread_query_count()
+
+    @property
+    def duration(self):
+        if self.root.duration is not None:
+            return self.root.duration
+        return time.perf_counter() - self.started_at
+
+    @property
+    def query_count(self):
+        return _thread_query_count() - self._query_count_start
+
+    def add_duration(self, name, duration):
+        self.durations[name] = self.durations.get(name, 0.0) + duration
+
+    def start_span(self, name, attributes=None):
+        span = Span(name, self._stack[-1].span_id, attributes)
+        self.spans.append(span)
+        self._stack.append(span)
+        return span
+
+    def end_span(self, span):
+        span.end()
+        if self._stack[-1] is span:
+            self._stack.pop()
+        self.add_duration(span.name, span.duration)
+
+
+def start_metrics(trace_id=None, parent_id=None, attributes=None):
+    _local.metrics = RequestMetrics(trace_id, parent_id, attributes)
+    return _local.metrics
+
+
+def stop_metrics():
+    metrics = current_metrics()
+    if metrics is not None and metrics.root.duration is None:
+        metrics.root.end()
+    _local.metrics = None
+    return metrics
+
+
+def current_metrics():
+    """Return the RequestMetrics of the current request, None outside api_route."""
+    return getattr(_local, 'metrics', None)
+
+
+@contextmanager
+def measure(name, **attributes):
+    """
+    Record the block as a span of the current request, and add its time
+    to the `name` duration of the request. Outside of a request, the
+    block runs without any recording.
+    """
+    metrics = current_metrics()
+    if metrics is None:
+        yield None
+        return
+    span = metrics.start_span(name, attributes)
+    try:
+        yield span
+    except Exception as e:
+        span.error = repr(e)
+        raise
+    finally:
+        metrics.end_span(span)
+
+
+def set_row_count(row_count):
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.row_count = row_count
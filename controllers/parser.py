@@ -1,128 +1,78 @@
 import re
 
-from pypeg2 import List, contiguous, csl, name, optional, parse
-
 from .exceptions import QueryFormatError
 
+WHITESPACE = re.compile(r'\s+')
+NAME = re.compile(r'\w+')
+UNQUOTED_VALUE = re.compile(r'[^,:"\'\)]+')
+QUOTED_VALUES = {
+    "'": re.compile(r'[^\']+'),
+    '"': re.compile(r'[^"]+'),
+}
 
-class IncludedField(List):
-    grammar = name()
-
-
-class ExcludedField(List):
-    grammar = contiguous('-', name())
-
-
-class AllFields(str):
-    grammar = '*'
-
-
-class BaseArgument(List):
-    @property
-    def value(self):
-        return self[0]
-
-
-class ArgumentWithoutQuotes(BaseArgument):
-    grammar = name(), ':', re.compile(r'[^,:"\'\)]+')
-
-
-class ArgumentWithSingleQuotes(BaseArgument):
-    grammar = name(), ':', "'", re.compile(r'[^\']+'), "'"
+# Message given when text follows an empty query, kept from the former
+# pypeg2 grammar
+EXPECTING_FIELD_MSG = 'expecting one of [%s]' % ', '.join(
+    "<class '%s.%s'>" % (__name__, grammar_name)
+    for grammar_name
+    in ['ParentField', 'IncludedField', 'ExcludedField', 'AllFields']
+)
 
 
-class ArgumentWithDoubleQuotes(BaseArgument):
-    grammar = name(), ':', '"', re.compile(r'[^"]+'), '"'
+class _Mismatch(Exception):
+    """The text at `pos` does not follow the grammar."""
 
+    def __init__(self, pos):
+        self.pos = pos
+        super(_Mismatch, self).__init__(pos)
 
-class Arguments(List):
-    grammar = optional(csl(
-        [
-            ArgumentWithoutQuotes,
-            ArgumentWithSingleQuotes,
-            ArgumentWithDoubleQuotes,
-        ],
-        separator=',',
-    ))
 
-
-class ArgumentsBlock(List):
-    grammar = optional('(', Arguments, ')')
-
-    @property
-    def arguments(self):
-        if self[0] is None:
-            return []
-        return self[0]
-
-
-class ParentField(List):
-    """
-    According to ParentField grammar:
-    self[0]  returns IncludedField instance,
-    self[1]  returns Block instance
+class Parser(object):
     """
-    @property
-    def name(self):
-        return self[0].name
-
-    @property
-    def block(self):
-        return self[1]
-
-
-class BlockBody(List):
-    grammar = optional(csl(
-        [ParentField, IncludedField, ExcludedField, AllFields],
-        separator=',',
-    ))
-
+    Single pass recursive descent parser of the queries:
 
-class Block(List):
-    grammar = ArgumentsBlock, '{', BlockBody, '}'
-
-    @property
-    def arguments(self):
-        return self[0].arguments
-
-    @property
-    def body(self):
-        return self[1]
-
-
-ParentField.grammar = IncludedField, Block
+        block     := ['(' [argument {',' argument}] ')'] '{' [field {',' field}] '}'
+        argument  := name ':' (value | "'" value "'" | '"' value '"')
+        field     := name block | name | '-'name | '*'
 
+    Whitespace is allowed between tokens, except between '-' and the
+    excluded field name.
+    """
 
-class Parser(object):
     def __init__(self, query):
         self._query = query
+        self._pos = 0
 
     def get_parsed(self):
-        parse_tree = parse(self._query, Block)
-        return self._transform_block(parse_tree)
-
-    def _transform_block(self, block):
-        fields = {
-            'include': [],
-            'exclude': [],
-            'arguments': {},
-        }
-
-        for argument in block.arguments:
-            argument = {str(argument.name): argument.value}
-            fields['arguments'].update(argument)
-
-        for field in block.body:
-            field = self._transform_field(field)
-
+        self._pos = 0
+        self._skip_whitespace()
+
+        start = self._pos
+        try:
+            arguments = self._parse_arguments()
+            self._expect('{')
+        except _Mismatch:
+            raise self._syntax_error("expecting '{'", start) from None
+
+        try:
+            fields = self._parse_block_body(arguments)
+        except _Mismatch as e:
+            raise self._syntax_error("expecting '}'", e.pos) from None
+
+        if self._pos < len(self._query):
+            if fields['include'] or fields['exclude']:
+                msg = "expecting ','"
+            else:
+                msg = EXPECTING_FIELD_MSG
+            raise self._syntax_error(msg, self._pos)
+
+        return self._transform_block(fields)
+
+    def _transform_block(self, fields):
+        for field in fields['include']:
             if isinstance(field, dict):
-                fields['include'].append(field)
-            elif isinstance(field, IncludedField):
-                fields['include'].append(str(field.name))
-            elif isinstance(field, ExcludedField):
-                fields['exclude'].append(str(field.name))
-            elif isinstance(field, AllFields):
-                fields['include'].append('*')
+                for nested_fields in field.values():
+                    self._transform_block(nested_fields)
 
         if fields['exclude']:
 
@@ -143,13 +93,121 @@ class Parser(object):
                 fields['include'].append('*')
         return fields
 
-    def _transform_field(self, field):
-        if isinstance(field, ParentField):
-            return self._transform_parent_field(field)
-        elif isinstance(field, (IncludedField, ExcludedField, AllFields)):
-            return field
+    ######
+    # Grammar
+    ######
+
+    def _parse_block(self):
+        arguments = self._parse_arguments()
+        self._expect('{')
+        return self._parse_block_body(arguments)
+
+    def _parse_arguments(self):
+        arguments = {}
+        if self._peek() != '(':
+            return arguments
+
+        self._expect('(')
+        if self._peek() != ')':
+            self._parse_argument(arguments)
+            while self._peek() == ',':
+                self._expect(',')
+                self._parse_argument(arguments)
+        self._expect(')')
+        return arguments
+
+    def _parse_argument(self, arguments):
+        argument_name = self._match(NAME)
+        self._expect(':')
+        quote = self._peek()
+        if quote in QUOTED_VALUES:
+            self._expect(quote)
+            value = self._match(QUOTED_VALUES[quote])
+            self._expect(quote)
+        else:
+            value = self._match(UNQUOTED_VALUE)
+        arguments[argument_name] = value
+
+    def _parse_block_body(self, arguments):
+        """Parse the fields of a block, up to its closing '}'."""
+        fields = {
+            'include': [],
+            'exclude': [],
+            'arguments': arguments,
+        }
+
+        if self._peek() != '}':
+            self._parse_field(fields)
+            while self._peek() == ',':
+                self._expect(',')
+                self._parse_field(fields)
+        self._expect('}')
+        return fields
 
-    def _transform_parent_field(self, parent_field):
-        parent_field_name = str(parent_field.name)
-        parent_field_value = self._transform_block(parent_field.block)
-        return {parent_field_name: parent_field_value}
+    def _parse_field(self, fields):
+        char = self._peek()
+        if char == '*':
+            self._expect('*')
+            fields['include'].append('*')
+        elif char == '-':
+            self._expect('-', skip_whitespace=False)
+            fields['exclude'].append(self._match(NAME))
+        else:
+            field_name = self._match(NAME)
+            if self._peek() in ('(', '{'):
+                fields['include'].append({field_name: self._parse_block()})
+            else:
+                fields['include'].append(field_name)
+
+    ######
+    # Scanner
+    ######
+
+    def _peek(self):
+        return self._query[self._pos:self._pos + 1]
+
+    def _skip_whitespace(self):
+        m = WHITESPACE.match(self._query, self._pos)
+        if m:
+            self._pos = m.end()
+
+    def _expect(self, literal, skip_whitespace=True):
+        if not self._query.startswith(literal, self._pos):
+            raise _Mismatch(self._pos)
+        self._pos += len(literal)
+        if skip_whitespace:
+            self._skip_whitespace()
+
+    def _match(self, regex):
+        m = regex.match(self._query, self._pos)
+        if not m:
+            raise _Mismatch(self._pos)
+        self._pos = m.end()
+        self._skip_whitespace()
+        return m.group(0)
+
+    def _syntax_error(self, msg, pos):
+        """
+        Build the SyntaxError, its text being the line excerpt around
+        `pos` (at most 19 characters before, 20 after), where the parser
+        stopped. The pypeg2 grammar placed it at the start of an enclosing
+        or earlier element instead, the messages are the same.
+        """
+        error = SyntaxError(msg)
+        error.lineno = self._query.count('\n', 0, pos) + 1
+        start = max(pos - 19, 0)
+        end = min(pos + 20, len(self._query))
+        text = self._query[start:end]
+        offset = pos - start + 1
+        while '\n' in text:
+            lf = text.find('\n')
+            if lf >= offset - 1:
+                # The error is on this line, at its end at the latest
+                text = text[:lf]
+                break
+            length = len(text)
+            text = text[lf + 1:]
+            offset -= length - len(text)
+        error.text = text
+        error.offset = offset
+        return error
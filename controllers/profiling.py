@@ -0,0 +1,159 @@
+import cProfile
+import logging
+import marshal
+import random
+import threading
+import time
+from collections import defaultdict, namedtuple
+
+from odoo import api, fields, registry, SUPERUSER_ID
+
+_logger = logging.getLogger(__name__)
+
+# Maximum depth of the stacks written to the collapsed stack file
+MAX_STACK_DEPTH = 200
+
+
+class ProfilePolicy(namedtuple('ProfilePolicy', ['rate', 'until'])):
+    """
+    Profiling of the requests of an API key:
+    rate   part of the requests profiled, between 0 and 1,
+    until  datetime after which the requests are not profiled anymore.
+    """
+    __slots__ = ()
+
+    def must_profile(self):
+        if self.until and self.until < fields.Datetime.now():
+            return False
+        return random.random() < self.rate
+
+
+class RequestProfiler(object):
+    """
+    cProfile profile and SQL queries of the code run in its block by the
+    current thread. The queries are collected through the query hooks
+    Odoo calls after each execution of a cursor of the thread.
+    """
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.queries = []
+        self._thread = None
+
+    def _query_hook(self, cr, query, params, start, delay, *args):
+        self.queries.append((start, delay, query, params))
+
+    def __enter__(self):
+        self._thread = threading.current_thread()
+        if not hasattr(self._thread, 'query_hooks'):
+            self._thread.query_hooks = []
+        self._thread.query_hooks.append(self._query_hook)
+        self.profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profile.disable()
+        self._thread.query_hooks.remove(self._query_hook)
+        self.profile.create_stats()
+
+    def get_pstats(self):
+        """Return the profile in the format of pstats files (Stats.dump_stats)."""
+        return marshal.dumps(self.profile.stats)
+
+    def get_collapsed_stacks(self):
+        """
+        Return the profile as collapsed stacks ('root;caller;function
+        microseconds' lines), the input of flamegraph.pl and speedscope.
+        cProfile only keeps caller/callee pairs, the time of a function is
+        spread over the stacks of its callers in proportion of the time
+        they spent in it.
+        """
+        stats = self.profile.stats
+        callees = defaultdict(dict)
+        for func, (cc, nc, tt, ct, callers) in stats.items():
+            for caller, caller_stats in callers.items():
+                callees[caller][func] = caller_stats[3]
+
+        samples = defaultdict(float)
+
+        def walk(func, stack, path, ratio):
+            stack = stack + (_frame_label(func),)
+            samples[stack] += stats[func][2] * ratio
+            if len(stack) >= MAX_STACK_DEPTH:
+                return
+            for callee, callee_time in callees[func].items():
+                total_time = stats[callee][3]
+                if callee in path or not total_time:
+                    continue
+                walk(callee, stack, path | {callee},
+                     ratio * min(callee_time / total_time, 1.0))
+
+        # Functions called from outside the profiled block start a stack,
+        # for the part of their time not spent under a profiled caller
+        for func, (cc, nc, tt, ct, callers) in stats.items():
+            if not callers:
+                walk(func, (), {func}, 1.0)
+            elif ct:
+                called_time = sum(caller[3] for caller in callers.values())
+                if called_time < ct:
+                    walk(func, (), {func}, 1.0 - called_time / ct)
+
+        return ''.join(
+            '%s %d\n' % (';'.join(stack), round(duration * 1e6))
+            for stack, duration in samples.items()
+            if round(duration * 1e6)
+        ).encode()
+
+    def get_queries(self):
+        """Return the SQL queries run, one per line with their duration."""
+        return ''.join(
+            '%.3f ms\t%s\t%r\n' % (
+                delay * 1000, _format_query(query), params)
+            for start, delay, query, params in self.queries
+        ).encode()
+
+
+def _frame_label(func):
+    filename, lineno, name = func
+    label = '%s (%s:%s)' % (name, filename, lineno) if lineno else name
+    return label.replace(';', ',')
+
+
+def _format_query(query):
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', errors='replace')
+    return ' '.join(str(query).split())
+
+
+def save_profiled_log(dbname, vals, profiler):
+    """
+    Write the log entry of a profiled request right away, with its
+    profile attached: pstats file, collapsed stacks and SQL queries.
+    """
+    try:
+        with registry(dbname).cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            log = env['pcv.api.handler.log'].create(dict(vals, profiled=True))
+            name = 'profile-%s-%s' % (
+                log.id, time.strftime('%Y%m%d%H%M%S', time.gmtime()))
+            env['ir.attachment'].create([{
+                'name': name + '.pstats',
+                'raw': profiler.get_pstats(),
+                'mimetype': 'application/octet-stream',
+                'res_model': log._name,
+                'res_id': log.id,
+            }, {
+                'name': name + '.collapsed.txt',
+                'raw': profiler.get_collapsed_stacks(),
+                'mimetype': 'text/plain',
+                'res_model': log._name,
+                'res_id': log.id,
+            }, {
+                'name': name + '.sql.txt',
+                'raw': profiler.get_queries(),
+                'mimetype': 'text/plain',
+                'res_model': log._name,
+                'res_id': log.id,
+            }])
+    except Exception:
+        _logger.exception('Could not save the profile of an API request')
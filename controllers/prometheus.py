@@ -0,0 +1,296 @@
+import atexit
+import errno
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+
+_logger = logging.getLogger(__name__)
+
+# Directory shared by the workers of the server, each one writes its
+# metrics in <pid>.json
+METRICS_DIRECTORY = os.path.join(tempfile.gettempdir(), 'kuw_api_metrics')
+# Seconds between two writes of the metrics of a worker
+METRICS_SYNC_INTERVAL = 5.0
+# File of the counters of the workers which are gone
+DEAD_WORKERS_FILE = 'dead.json'
+
+# Upper bounds in seconds of the buckets of the latency histogram
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUESTS_TOTAL = 'kuw_api_requests_total'
+ERRORS_TOTAL = 'kuw_api_request_errors_total'
+DURATION = 'kuw_api_request_duration_seconds'
+IN_FLIGHT = 'kuw_api_requests_in_flight'
+CACHE_LOOKUPS_TOTAL = 'kuw_api_response_cache_lookups_total'
+CACHE_BYTES = 'kuw_api_response_cache_bytes'
+
+METRICS = [
+    (REQUESTS_TOTAL, 'counter', 'Number of API requests.'),
+    (ERRORS_TOTAL, 'counter', 'Number of failed API requests.'),
+    (DURATION, 'histogram', 'Duration of the API requests in seconds.'),
+    (IN_FLIGHT, 'gauge', 'Number of API requests being processed.'),
+    (CACHE_LOOKUPS_TOTAL, 'counter', 'Lookups in the GET response cache by result.'),
+    (CACHE_BYTES, 'gauge', 'Size of the bodies held by the GET response cache.'),
+]
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+_BUCKET_BOUNDS = [_format_bound(b) for b in LATENCY_BUCKETS + (float('inf'),)]
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class MetricsRegistry(object):
+    """
+    Request metrics of the API, in Prometheus form.
+
+    A request only updates dictionaries of its own process. A background
+    thread of each prefork worker writes them to a file of a directory
+    shared by the workers, and `collect` adds the files up. The counters
+    of the workers which are gone are kept in a single file, their
+    in-flight gauges are dropped.
+
+    Samples are keyed by (metric name, labels), labels being a tuple of
+    (name, value) pairs.
+    """
+
+    def __init__(self, directory=METRICS_DIRECTORY, interval=METRICS_SYNC_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._counters = {}
+        self._gauges = {}
+        self._thread = None
+        self._stopping = None
+
+    ######
+    # Recording
+    ######
+
+    def request_started(self, route, method):
+        self._ensure_started()
+        key = (IN_FLIGHT, (('route', route), ('method', method)))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + 1
+
+    def request_finished(self, route, method, handler, duration, error=False):
+        labels = (('route', route), ('method', method), ('handler', handler or ''))
+        gauge_key = (IN_FLIGHT, labels[:2])
+        with self._lock:
+            counters = self._counters
+            self._gauges[gauge_key] = self._gauges.get(gauge_key, 0) - 1
+            self._inc(REQUESTS_TOTAL, labels)
+            if error:
+                self._inc(ERRORS_TOTAL, labels)
+            # Cumulative buckets, all of them exist once the series does
+            for bound, le in zip(LATENCY_BUCKETS, _BUCKET_BOUNDS):
+                self._inc(DURATION + '_bucket', labels + (('le', le),),
+                          duration <= bound)
+            self._inc(DURATION + '_bucket', labels + (('le', '+Inf'),))
+            self._inc(DURATION + '_count', labels)
+            sum_key = (DURATION + '_sum', labels)
+            counters[sum_key] = counters.get(sum_key, 0.0) + duration
+
+    def inc_counter(self, name, labels, amount=1):
+        self._ensure_started()
+        with self._lock:
+            self._inc(name, labels, amount)
+
+    def set_gauge(self, name, labels, value):
+        self._ensure_started()
+        with self._lock:
+            self._gauges[(name, labels)] = value
+
+    def _inc(self, name, labels, amount=1):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    ######
+    # Sharing between the workers
+    ######
+
+    def _ensure_started(self):
+        # A forked worker starts from the metrics of its parent, which are
+        # counted in the file of the parent.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._counters = {}
+            self._gauges = {}
+            self._stopping = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run,
+                name='kuw_api.metrics',
+                daemon=True,
+            )
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.sync()
+
+    def stop(self):
+        """Stop the background thread and write the metrics of the worker."""
+        if self._pid != os.getpid():
+            return
+        self._stopping.set()
+        self._thread.join(self.interval * 2)
+        with self._lock:
+            self._gauges = {}
+        self.sync()
+
+    def _snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[n, l, v] for (n, l), v in self._counters.items()],
+                'gauges': [[n, l, v] for (n, l), v in self._gauges.items() if v],
+            }
+
+    def sync(self):
+        """Write the metrics of the current worker to its file."""
+        if self._pid != os.getpid():
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._write_file(
+                os.path.join(self.directory, '%s.json' % self._pid),
+                self._snapshot())
+        except OSError:
+            _logger.exception('Could not write the API metrics')
+
+    def _write_file(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as tmp_file:
+            json.dump(data, tmp_file)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _read_file(path):
+        try:
+            with open(path) as metrics_file:
+                return json.load(metrics_file)
+        except (OSError, ValueError):
+            return {}
+
+    ######
+    # Exposition
+    ######
+
+    def collect(self):
+        """
+        Return the (counters, gauges) of all the workers, as dictionaries
+        keyed by (metric name, labels).
+        """
+        self._ensure_started()
+        os.makedirs(self.directory, exist_ok=True)
+        counters = {}
+        gauges = {}
+
+        def add(samples, totals):
+            for name, labels, value in samples:
+                key = (name, tuple(tuple(label) for label in labels))
+                totals[key] = totals.get(key, 0) + value
+
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            dead_path = os.path.join(self.directory, DEAD_WORKERS_FILE)
+            dead_counters = self._read_file(dead_path).get('counters', [])
+            dead_files = []
+            for file_name in os.listdir(self.directory):
+                pid = file_name[:-len('.json')]
+                if not file_name.endswith('.json') or not pid.isdigit() \
+                        or int(pid) == self._pid:
+                    continue
+                data = self._read_file(os.path.join(self.directory, file_name))
+                if _pid_alive(int(pid)):
+                    add(data.get('counters', []), counters)
+                    add(data.get('gauges', []), gauges)
+                else:
+                    dead_counters.extend(data.get('counters', []))
+                    dead_files.append(file_name)
+
+            if dead_files:
+                # Merge the counters of the dead workers in one file so that
+                # the number of files does not grow with worker recycling
+                merged = {}
+                add(dead_counters, merged)
+                dead_counters = [[n, l, v] for (n, l), v in merged.items()]
+                self._write_file(dead_path, {'counters': dead_counters})
+                for file_name in dead_files:
+                    os.remove(os.path.join(self.directory, file_name))
+            add(dead_counters, counters)
+
+        snapshot = self._snapshot()
+        add(snapshot['counters'], counters)
+        add(snapshot['gauges'], gauges)
+        return counters, gauges
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        counters, gauges = self.collect()
+        samples = dict(counters)
+        samples.update(gauges)
+        lines = []
+        for name, metric_type, help_text in METRICS:
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, metric_type))
+            if metric_type == 'histogram':
+                names = (name + '_bucket', name + '_sum', name + '_count')
+            else:
+                names = (name,)
+            keys = sorted(
+                (k for k in samples if k[0] in names),
+                key=lambda k: _sort_key(k, names))
+            for key in keys:
+                lines.append('%s%s %s' % (
+                    key[0], _format_labels(key[1]), _format_value(samples[key])))
+        return '\n'.join(lines) + '\n'
+
+
+def _sort_key(key, names):
+    # Samples of a series together, histogram buckets by increasing bound
+    name, labels = key
+    le = dict(labels).get('le')
+    return (
+        tuple(label for label in labels if label[0] != 'le'),
+        names.index(name),
+        float(le) if le else 0.0,
+    )
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, _escape_label_value(value))
+        for name, value in labels)
+
+
+def _format_value(value):
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+metrics_registry = MetricsRegistry()
+atexit.register(metrics_registry.stop)
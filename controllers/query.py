@@ -0,0 +1,239 @@
+import functools
+import weakref
+from collections import namedtuple
+from types import MappingProxyType
+
+from .parser import Parser
+from .exceptions import QueryFormatError
+
+# Number of distinct query strings whose plan is kept in memory
+QUERY_PLAN_CACHE_SIZE = 256
+
+
+class FieldPlan(namedtuple('FieldPlan', ['name', 'alias', 'filter_func', 'nested'])):
+    """
+    One field to serialize:
+    name         the field name on the model,
+    alias        the key used in the output,
+    filter_func  name of the recordset method filtering a x2many, or None,
+    nested       QueryPlan of a nested field, None for a flat field.
+    """
+    __slots__ = ()
+
+
+class FieldInfo(namedtuple('FieldInfo', ['type', 'relational', 'comodel_name', 'groups'])):
+    """Metadata of a model field needed to serialize it."""
+    __slots__ = ()
+
+
+# model class -> (registry sequence, {field name: FieldInfo})
+_model_fields = weakref.WeakKeyDictionary()
+
+
+def get_model_fields(rec):
+    """
+    Return the read-only mapping {field name: FieldInfo} of the model of
+    `rec`, in the model field order.
+    Model classes belong to one registry, and the registry sequence is
+    bumped whenever the fields of a model change, so the mapping is
+    rebuilt on any registry reload.
+    """
+    model_class = type(rec)
+    registry_sequence = rec.pool.registry_sequence
+    cached = _model_fields.get(model_class)
+    if cached is None or cached[0] != registry_sequence:
+        fields_info = MappingProxyType({
+            field_name: FieldInfo(
+                field.type,
+                field.relational,
+                field.comodel_name,
+                field.groups,
+            )
+            for field_name, field in rec._fields.items()
+        })
+        cached = (registry_sequence, fields_info)
+        _model_fields[model_class] = cached
+    return cached[1]
+
+
+class QueryPlan(object):
+    """
+    Immutable and model independent form of a parsed query.
+    The '*' operator is expanded once per model, see get_fields.
+    """
+    __slots__ = ('fields', 'include_all', 'exclude', 'arguments', '_expanded')
+
+    def __init__(self, fields, include_all=False, exclude=(), arguments=None):
+        object.__setattr__(self, 'fields', tuple(fields))
+        object.__setattr__(self, 'include_all', include_all)
+        object.__setattr__(self, 'exclude', frozenset(exclude))
+        object.__setattr__(self, 'arguments', tuple(
+            sorted((arguments or {}).items())))
+        # model class -> (fields info, expanded fields), expanded again
+        # when get_model_fields rebuilds the fields info of the model.
+        object.__setattr__(self, '_expanded', weakref.WeakKeyDictionary())
+
+    def __setattr__(self, name, value):
+        raise AttributeError('QueryPlan is immutable')
+
+    @classmethod
+    def from_parsed(cls, parsed_query):
+        arguments = parsed_query['arguments']
+        fields = []
+        include_all = False
+        for field in parsed_query['include']:
+            if field == '*':
+                include_all = True
+            elif isinstance(field, dict):
+                for nested_field, nested_parsed_query in field.items():
+                    fields.append(get_field_plan(
+                        nested_field,
+                        arguments,
+                        cls.from_parsed(nested_parsed_query),
+                    ))
+            else:
+                fields.append(get_field_plan(field, arguments))
+
+        return cls(fields, include_all, parsed_query['exclude'], arguments)
+
+    @property
+    def is_empty(self):
+        """The query is empty i.e query={}"""
+        return not self.fields and not self.include_all
+
+    def get_fields(self, rec):
+        """
+        Return the FieldPlan to serialize for the model of `rec`,
+        in output order.
+        """
+        model_class = type(rec)
+        all_fields = get_model_fields(rec)
+        cached = self._expanded.get(model_class)
+        if cached is None or cached[0] is not all_fields:
+            cached = (all_fields, self._expand(all_fields))
+            self._expanded[model_class] = cached
+        return cached[1]
+
+    def _expand(self, all_fields):
+        arguments = dict(self.arguments)
+
+        # A field coming twice keeps its first position and its last
+        # definition, as successive dict updates would.
+        fields = {field.name: field for field in self.fields}
+        if self.include_all:
+            for field_name in self.exclude:
+                if field_name not in all_fields:
+                    msg = "'%s' field is not found" % field_name
+                    raise LookupError(msg)
+            for field_name in all_fields:
+                if field_name not in self.exclude:
+                    fields[field_name] = get_field_plan(field_name, arguments)
+
+        for field_name in fields:
+            if field_name not in all_fields:
+                msg = "'%s' field is not found" % field_name
+                raise LookupError(msg)
+        return tuple(fields.values())
+
+
+def get_field_plan(field_name, arguments, nested=None):
+    """
+    Resolve the alias and filter function given to a field through the
+    block arguments. Ex: (lines:order_lines~filter_done)
+    """
+    arg = arguments.get(field_name)
+    if not arg:
+        return FieldPlan(field_name, field_name, None, nested)
+
+    arr_arg = arg.split('~')
+    if len(arr_arg) > 1:
+        return FieldPlan(field_name, arr_arg[0], arr_arg[1], nested)
+
+    return FieldPlan(field_name, arr_arg[0], None, nested)
+
+
+def parse_query(query):
+    parser = Parser(query)
+    try:
+        return parser.get_parsed()
+    except SyntaxError as e:
+        msg = 'QuerySyntaxError: ' + e.msg + ' on ' + e.text
+        raise SyntaxError(msg) from None
+    except QueryFormatError as e:
+        msg = 'QueryFormatError: ' + str(e)
+        raise QueryFormatError(msg) from None
+
+
+@functools.lru_cache(maxsize=QUERY_PLAN_CACHE_SIZE)
+def compile_query(query):
+    """
+    Parse a query and build its plan. Controllers send constant query
+    strings, so the plan is cached on the query text.
+    """
+    return QueryPlan.from_parsed(parse_query(query))
+
+
+def _included_name(field):
+    return next(iter(field)) if isinstance(field, dict) else field
+
+
+def restrict_query(parsed_query, allowed_query):
+    """
+    Limit a parsed query sent by a client to the parsed query `allowed_query`
+    of the endpoint: only its fields can be asked, and only its nested
+    fields expanded. '*' stands for all the allowed fields. The aliases
+    and filter functions are the ones of `allowed_query`, a client can
+    not give arguments.
+    """
+    if parsed_query['arguments']:
+        raise QueryFormatError('Arguments can not be given in the query')
+
+    allowed_nested = {}
+    for field in allowed_query['include']:
+        if isinstance(field, dict):
+            allowed_nested.update(field)
+    allow_all = '*' in allowed_query['include']
+    allowed_names = {_included_name(f) for f in allowed_query['include']}
+
+    restricted = {
+        'include': [],
+        'exclude': [],
+        'arguments': dict(allowed_query['arguments']),
+    }
+    for field in parsed_query['include']:
+        if field == '*':
+            if allow_all:
+                restricted['include'].append('*')
+                restricted['exclude'].extend(parsed_query['exclude'])
+            else:
+                restricted['include'].extend(
+                    f for f in allowed_query['include']
+                    if _included_name(f) not in parsed_query['exclude'])
+        elif isinstance(field, dict):
+            field_name, nested_query = next(iter(field.items()))
+            if field_name not in allowed_nested:
+                raise QueryFormatError(
+                    "'%s' field can not be expanded" % field_name)
+            restricted['include'].append({field_name: restrict_query(
+                nested_query, allowed_nested[field_name])})
+        elif allow_all or field in allowed_names:
+            restricted['include'].append(field)
+        else:
+            raise QueryFormatError("'%s' field is not allowed" % field)
+    return restricted
+
+
+@functools.lru_cache(maxsize=QUERY_PLAN_CACHE_SIZE)
+def compile_client_query(query, allowed_query):
+    """
+    Parse a query sent by a client, restrict it to the query allowed by
+    the endpoint and build its plan.
+    """
+    try:
+        restricted = restrict_query(parse_query(query), parse_query(allowed_query))
+    except QueryFormatError as e:
+        msg = str(e)
+        if not msg.startswith('QueryFormatError: '):
+            msg = 'QueryFormatError: ' + msg
+        raise QueryFormatError(msg) from None
+    return QueryPlan.from_parsed(restricted)
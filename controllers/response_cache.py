@@ -0,0 +1,80 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+from .prometheus import metrics_registry, CACHE_BYTES, CACHE_LOOKUPS_TOTAL
+
+# Maximum size of the response bodies kept by a worker
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Maximum number of responses kept by a worker
+RESPONSE_CACHE_MAX_ENTRIES = 4096
+# Responses bigger than this part of the cache are not kept
+RESPONSE_CACHE_MAX_ENTRY_RATIO = 0.25
+
+CachedResponse = namedtuple(
+    'CachedResponse', ['generation', 'body', 'row_count', 'etag'])
+
+
+class ResponseCache(object):
+    """
+    Per-process LRU cache of the bodies of GET responses, bounded in
+    number of entries and in bytes.
+
+    Each entry keeps the generations of the models it holds the data of
+    when it was computed, and the ETag sent with its body; a lookup with
+    other generations drops the entry. Generations are shared by the
+    workers through the database (see pcv.api.cache.mixin), so a write in
+    one worker invalidates the entries of all of them.
+    """
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES,
+                 max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, model_name, key, generation):
+        """Return the CachedResponse of `key` if it is still current, else None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                result = 'miss'
+            elif entry.generation != generation:
+                self._remove(key)
+                entry = None
+                result = 'stale'
+            else:
+                self._entries.move_to_end(key)
+                result = 'hit'
+        metrics_registry.inc_counter(
+            CACHE_LOOKUPS_TOTAL, (('model', model_name), ('result', result)))
+        return entry
+
+    def set(self, key, generation, body, row_count, etag=None):
+        if len(body) > self.max_bytes * RESPONSE_CACHE_MAX_ENTRY_RATIO:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = CachedResponse(
+                generation, body, row_count, etag)
+            self.size += len(body)
+            while self.size > self.max_bytes \
+                    or len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            size = self.size
+        metrics_registry.set_gauge(CACHE_BYTES, (), size)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+        metrics_registry.set_gauge(CACHE_BYTES, (), 0)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.size -= len(entry.body)
+
+
+response_cache = ResponseCache()
@@ -1,14 +1,69 @@
-import datetime
-from itertools import chain
 import logging
 import json
+from collections import OrderedDict
 
-from .parser import Parser
-from .exceptions import QueryFormatError
+from odoo.models import PREFETCH_MAX
+from odoo.tools import split_every
+
+from .metrics import measure
+from .query import QueryPlan, compile_query, get_model_fields, parse_query
 
 _logger = logging.getLogger(__name__)
 
 
+X2MANY_TYPES = ('one2many', 'many2many')
+
+# Number of records read at once by Serializer.serialize_many
+SERIALIZE_CHUNK_SIZE = PREFETCH_MAX
+
+
+def convert_datetime(value):
+    return value and value.astimezone().replace(microsecond=0).isoformat()
+
+
+def convert_date(value):
+    return value and value.strftime('%Y-%m-%d')
+
+
+def convert_time(value):
+    return value and value.strftime('%H:%M:%S')
+
+
+def convert_json(value):
+    return value and json.loads(value)
+
+
+def convert_binary(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def convert_image(value):
+    if isinstance(value, bytes):
+        return 'data:image/png;base64,' + value.decode('utf-8')
+    return value
+
+
+def get_converter(field_name, field_type):
+    """
+    Return the function turning the value of a flat field into its
+    serialized value, or None when the value is sent as is.
+    many2one and x2many values are expected as ids.
+    """
+    if field_type == 'datetime':
+        return convert_datetime
+    elif field_type == 'date':
+        return convert_date
+    elif field_type == 'time':
+        return convert_time
+    elif field_type == 'binary':
+        return convert_image if "image_" in field_name else convert_binary
+    elif field_type == 'text' and field_name.endswith('_json'):
+        return convert_json
+    return None
+
+
 class Serializer(object):
     def __init__(self, record, query='{*}', many=False, overwrites_values={}):
         self.many = many
@@ -18,42 +73,39 @@ class Serializer(object):
         super().__init__()
 
     def get_parsed_restql_query(self):
-        parser = Parser(self._raw_query)
-        try:
-            parsed_restql_query = parser.get_parsed()
-            return parsed_restql_query
-        except SyntaxError as e:
-            msg = 'QuerySyntaxError: ' + e.msg + ' on ' + e.text
-            raise SyntaxError(msg) from None
-        except QueryFormatError as e:
-            msg = 'QueryFormatError: ' + str(e)
-            raise QueryFormatError(msg) from None
+        return parse_query(self._raw_query)
+
+    def get_query_plan(self):
+        if isinstance(self._raw_query, QueryPlan):
+            return self._raw_query
+        return compile_query(self._raw_query)
 
     @property
     def data(self):
-        parsed_restql_query = self.get_parsed_restql_query()
-        if self.many:
-            return [
-                self.serialize(
-                    rec, parsed_restql_query, self.overwrites_values)
-                for rec
-                in self._record
-            ]
-        return self.serialize(
-            self._record, parsed_restql_query, self.overwrites_values)
+        with measure('serialize'):
+            query_plan = self.get_query_plan()
+            if self.many:
+                return self.serialize_many(
+                    self._record, query_plan, self.overwrites_values)
+            return self.serialize(
+                self._record, query_plan, self.overwrites_values)
+
+    @property
+    def columnar_data(self):
+        """The records as {'columns': [name, ...], 'rows': [[value, ...], ...]}."""
+        with measure('serialize'):
+            columns, rows = self.serialize_columns(
+                self._record, self.get_query_plan(), self.overwrites_values)
+            return {'columns': columns, 'rows': rows}
 
     @classmethod
-    def build_flat_field(cls, rec, field_name, arguments):
-        all_fields = rec.fields_get_keys()
-        field_name_overwrite, filter_func = cls.get_arguments_value(
-            arguments, field_name)
-        if field_name not in all_fields:
-            msg = "'%s' field is not found" % field_name
-            raise LookupError(msg)
-        field_type = rec.fields_get(field_name).get(field_name).get('type')
-        if field_type in ['one2many', 'many2many']:
-            if filter_func:
-                child_record = getattr(rec[field_name], filter_func)()
+    def build_flat_field(cls, rec, field, field_info):
+        field_name = field.name
+        field_name_overwrite = field.alias
+        field_type = field_info.type
+        if field_type in X2MANY_TYPES:
+            if field.filter_func:
+                child_record = getattr(rec[field_name], field.filter_func)()
             else:
                 child_record = rec[field_name]
 
@@ -62,55 +114,32 @@ class Serializer(object):
             }
         elif field_type in ['many2one']:
             return {field_name_overwrite: rec[field_name].id}
-        elif field_type == 'datetime' and rec[field_name]:
-            return {
-                field_name_overwrite: rec[field_name].astimezone().replace(
-                    microsecond=0).isoformat(),
-            }
-        elif field_type == 'date' and rec[field_name]:
-            return {
-                field_name_overwrite: rec[field_name].strftime('%Y-%m-%d'),
-            }
-        elif field_type == 'time' and rec[field_name]:
-            return {
-                field_name_overwrite: rec[field_name].strftime('%H:%M:%S'),
-            }
-        elif field_type == 'binary' and isinstance(rec[field_name], bytes):
-            val = rec[field_name].decode('utf-8')
-            if "image_" in field_name:
-                val = 'data:image/png;base64,' + val
-        elif field_type == 'text' and field_name.endswith('_json') and rec[field_name]:
-            val = json.loads(rec[field_name])
-
-            return {field_name_overwrite: val}
-        else:
-            return {field_name_overwrite: rec[field_name]}
+
+        convert = get_converter(field_name, field_type)
+        if convert:
+            return {field_name_overwrite: convert(rec[field_name])}
+        return {field_name_overwrite: rec[field_name]}
 
     @classmethod
-    def build_nested_field(cls, rec, field_name, nested_parsed_query, arguments):
-        all_fields = rec.fields_get_keys()
-        field_name_overwrite, filter_func = cls.get_arguments_value(arguments, field_name)
-        if field_name not in all_fields:
-            msg = "'%s' field is not found" % field_name
-            raise LookupError(msg)
-        field_type = rec.fields_get(field_name).get(field_name).get('type')
-        if field_type in ['one2many', 'many2many']:
-            if filter_func:
-                child_record = getattr(rec[field_name], filter_func)()
+    def build_nested_field(cls, rec, field, field_info):
+        field_name = field.name
+        field_name_overwrite = field.alias
+        nested_query_plan = field.nested
+        field_type = field_info.type
+        if field_type in X2MANY_TYPES:
+            if field.filter_func:
+                child_record = getattr(rec[field_name], field.filter_func)()
             else:
                 child_record = rec[field_name]
 
             return {
-                field_name_overwrite: [
-                    cls.serialize(record, nested_parsed_query)
-                    for record
-                    in child_record
-                ]
+                field_name_overwrite: cls.serialize_many(
+                    child_record, nested_query_plan),
             }
         elif field_type in ['many2one']:
             if rec[field_name]:
                 return {
-                    field_name_overwrite: cls.serialize(rec[field_name], nested_parsed_query)
+                    field_name_overwrite: cls.serialize(rec[field_name], nested_query_plan)
                 }
             else:
                 return {
@@ -122,66 +151,196 @@ class Serializer(object):
             raise ValueError(msg)
 
     @classmethod
-    def serialize(cls, rec, parsed_query, overwrites_values={}):
-        data = {}
+    def serialize_many(cls, records, query_plan, overwrites_values={}):
+        """
+        Serialize a whole recordset. The flat fields are fetched with one
+        read() per chunk of records and converted column by column; the
+        output is the same as serializing the records one by one.
+        """
+        if isinstance(query_plan, dict):
+            query_plan = QueryPlan.from_parsed(query_plan)
 
-        # NOTE: self.parsed_restql_query["include"] not being empty
-        # is not a guarantee that the exclude operator(-) has not been
-        # used because the same self.parsed_restql_query["include"]
-        # is used to store nested fields when the exclude operator(-) is used
-        if parsed_query["exclude"]:
-            # Exclude fields from a query
-            all_fields = rec.fields_get_keys()
-            for field in parsed_query["include"]:
-                if field == "*":
-                    continue
-                for nested_field, nested_parsed_query in field.items():
-                    built_nested_field = cls.build_nested_field(
-                        rec,
-                        nested_field,
-                        nested_parsed_query,
-                        parsed_query["arguments"]
-                    )
-                    data.update(built_nested_field)
-
-            flat_fields = set(all_fields).symmetric_difference(set(parsed_query['exclude']))
-            for field in flat_fields:
-                flat_field = cls.build_flat_field(rec, field, parsed_query["arguments"])
-                data.update(flat_field)
-
-        elif parsed_query["include"]:
-            # Here we are sure that self.parsed_restql_query["exclude"]
-            # is empty which means the exclude operator(-) is not used,
-            # so self.parsed_restql_query["include"] contains only fields
-            # to include
-            all_fields = rec.fields_get_keys()
-            if "*" in parsed_query['include']:
-                # Include all fields
-                parsed_query['include'] = filter(
-                    lambda item: item != "*",
-                    parsed_query['include']
-                )
-                fields = chain(parsed_query['include'], all_fields)
-                parsed_query['include'] = list(fields)
-
-            for field in parsed_query["include"]:
-                if isinstance(field, dict):
-                    for nested_field, nested_parsed_query in field.items():
-                        built_nested_field = cls.build_nested_field(
-                            rec,
-                            nested_field,
-                            nested_parsed_query,
-                            parsed_query["arguments"]
-                        )
-                        data.update(built_nested_field)
-                else:
-                    flat_field = cls.build_flat_field(rec, field, parsed_query["arguments"])
-                    data.update(flat_field)
-        else:
+        data = []
+        for ids in split_every(SERIALIZE_CHUNK_SIZE, records.ids):
+            chunk_data = cls._serialize_chunk(
+                records.browse(ids), query_plan, overwrites_values)[1]
+            data.extend(chunk_data)
+        return data
+
+    @classmethod
+    def serialize_columns(cls, records, query_plan, overwrites_values={}):
+        """
+        Serialize a whole recordset in columnar form: return the names of
+        the fields and the rows of their values, in the same order, without
+        building a dict per record. Nested fields keep their usual form.
+        """
+        if isinstance(query_plan, dict):
+            query_plan = QueryPlan.from_parsed(query_plan)
+
+        names = None
+        rows = []
+        for ids in split_every(SERIALIZE_CHUNK_SIZE, records.ids):
+            chunk, columns = cls._serialize_columns(
+                records.browse(ids), query_plan, overwrites_values)
+            if names is None:
+                names = list(columns)
+            if columns:
+                rows.extend(zip(*columns.values()))
+            else:
+                rows.extend(() for rec in chunk)
+        if names is None:
+            # No records, the names still come from the query
+            names = list(cls._serialize_columns(
+                records.browse(), query_plan, overwrites_values)[1])
+        return names, rows
+
+    @classmethod
+    def _serialize_chunk(cls, records, query_plan, overwrites_values={}):
+        """
+        Return the serialized records with the data of each one.
+        The records which do not exist anymore are left out.
+        """
+        records, columns = cls._serialize_columns(
+            records, query_plan, overwrites_values)
+        data = [{} for rec in records]
+        for alias, column in columns.items():
+            for row, value in zip(data, column):
+                row[alias] = value
+        return records, data
+
+    @classmethod
+    def _serialize_columns(cls, records, query_plan, overwrites_values={}):
+        """
+        Return the serialized records with the column of values of each
+        field, by alias. The records which do not exist anymore are left out.
+        """
+        columns = OrderedDict()
+        if query_plan.is_empty:
+            # The query is empty i.e query={}
+            return records, columns
+
+        fields_info = get_model_fields(records)
+        fields = query_plan.get_fields(records)
+
+        # Flat fields and the ids of nested fields are read in batch,
+        # x2many with a filter function need the records
+        read_fields = []
+        record_fields = []
+        for field in fields:
+            if field.filter_func \
+                    and fields_info[field.name].type in X2MANY_TYPES:
+                record_fields.append(field.name)
+            else:
+                read_fields.append(field.name)
+
+        values = {}
+        if read_fields:
+            rows = records.read(read_fields, load=None)
+            if len(rows) != len(records):
+                # Some records vanished since the search
+                records = records.browse([vals['id'] for vals in rows])
+            for field_name in read_fields:
+                values[field_name] = [vals[field_name] for vals in rows]
+        if record_fields:
+            restricted = [
+                field_name
+                for field_name in record_fields
+                if fields_info[field_name].groups
+            ]
+            if restricted:
+                records.check_field_access_rights('read', restricted)
+
+        for field in fields:
+            field_info = fields_info[field.name]
+            if field.nested is not None:
+                column = cls._load_nested_column(
+                    records, field, field_info, values.get(field.name))
+            elif field.name in values:
+                column = values[field.name]
+                convert = get_converter(field.name, field_info.type)
+                if convert:
+                    column = [convert(value) for value in column]
+            else:
+                column = [
+                    [record.id for record in getattr(
+                        rec[field.name], field.filter_func)()]
+                    for rec in records
+                ]
+            columns[field.alias] = column
+
+        # Overide the value with the define function
+        for key, value in overwrites_values.items():
+            if callable(value):
+                column = columns.get(key) or [None] * len(records)
+                columns[key] = [value(item, key=key) for item in column]
+            else:
+                columns[key] = [value] * len(records)
+
+        return records, columns
+
+    @classmethod
+    def _load_nested_column(cls, records, field, field_info, ids_column):
+        """
+        Serialize a nested field for all the records at once: the related
+        records of the whole batch are serialized together, then dispatched
+        back to their parent.
+        """
+        field_type = field_info.type
+        if field_type not in X2MANY_TYPES and field_type != 'many2one':
+            # Not a neste field
+            msg = "'%s' is not a nested field" % field.name
+            raise ValueError(msg)
+
+        if field_type in X2MANY_TYPES and field.filter_func:
+            ids_column = [
+                getattr(rec[field.name], field.filter_func)().ids
+                for rec in records
+            ]
+
+        related_ids = []
+        for ids in ids_column:
+            if field_type == 'many2one':
+                ids = [ids] if ids else []
+            related_ids.extend(ids)
+        related_ids = list(dict.fromkeys(related_ids))
+
+        related_data = {}
+        comodel = records.env[field_info.comodel_name]
+        for ids in split_every(SERIALIZE_CHUNK_SIZE, related_ids):
+            related, data = cls._serialize_chunk(
+                comodel.browse(ids), field.nested)
+            related_data.update(zip(related.ids, data))
+
+        if field_type == 'many2one':
+            return [related_data.get(ids, False) for ids in ids_column]
+        return [
+            [related_data[id_] for id_ in ids if id_ in related_data]
+            for ids in ids_column
+        ]
+
+    @classmethod
+    def serialize(cls, rec, query_plan, overwrites_values={}):
+        if isinstance(query_plan, dict):
+            # Parsed query as returned by get_parsed_restql_query
+            query_plan = QueryPlan.from_parsed(query_plan)
+
+        if query_plan.is_empty:
             # The query is empty i.e query={}
             # return nothing
             return {}
 
+        data = {}
+        fields_info = get_model_fields(rec)
+        for field in query_plan.get_fields(rec):
+            field_info = fields_info[field.name]
+            if field_info.groups:
+                # Fields restricted to some groups
+                rec.check_field_access_rights('read', [field.name])
+            if field.nested is not None:
+                data.update(cls.build_nested_field(rec, field, field_info))
+            else:
+                data.update(cls.build_flat_field(rec, field, field_info))
+
         # Overide the value with the define function
         for key, value in overwrites_values.items():
             if callable(value):
@@ -190,15 +349,3 @@ class Serializer(object):
                 data[key] = value
 
         return data
-
-    @classmethod
-    def get_arguments_value(self, arguments, key):
-        arg = arguments.get(key)
-        if not arg:
-            return [key, None]
-
-        arr_arg = arg.split('~')
-        if len(arr_arg) > 1:
-            return [arr_arg[0], arr_arg[1]]
-
-        return [arr_arg[0], None]
@@ -0,0 +1,81 @@
+import json
+import logging
+import re
+import threading
+
+from odoo.tools import config
+
+_logger = logging.getLogger(__name__)
+
+# version-trace_id-parent_id-flags, https://www.w3.org/TR/trace-context/
+TRACEPARENT = re.compile(
+    r'^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+# Odoo configuration option of the JSON lines file receiving the spans
+TRACE_FILE_OPTION = 'kuw_api_trace_file'
+
+_trace_file_lock = threading.Lock()
+
+
+def parse_traceparent(header):
+    """
+    Return the (trace_id, parent_id) of a `traceparent` header, or
+    (None, None) if it is missing or invalid.
+    """
+    match = header and TRACEPARENT.match(header.strip().lower())
+    if not match:
+        return None, None
+    trace_id, parent_id = match.groups()
+    if trace_id == '0' * 32 or parent_id == '0' * 16:
+        return None, None
+    return trace_id, parent_id
+
+
+def server_timing_header(metrics):
+    """
+    Return the Server-Timing header of a request: the time spent by span
+    name in milliseconds, then the total, e.g.
+    'auth;dur=0.8, search;dur=2.1, serialize;dur=5.0, total;dur=9.1'
+    """
+    timings = [
+        '%s;dur=%.2f' % (name, duration * 1000)
+        for name, duration in metrics.durations.items()
+    ]
+    timings.append('total;dur=%.2f' % (metrics.duration * 1000))
+    return ', '.join(timings)
+
+
+def write_trace(metrics):
+    """
+    Append the spans of a request to the trace file set by the
+    kuw_api_trace_file option, as OpenTelemetry shaped JSON lines.
+    """
+    path = config.get(TRACE_FILE_OPTION)
+    if not path:
+        return
+    lines = ''.join(
+        json.dumps(_span_record(metrics, span)) + '\n'
+        for span in metrics.spans
+        if span.end_time is not None
+    )
+    try:
+        with _trace_file_lock, open(path, 'a') as trace_file:
+            trace_file.write(lines)
+    except OSError:
+        _logger.exception('Could not write the API traces to %s', path)
+
+
+def _span_record(metrics, span):
+    record = {
+        'traceId': metrics.trace_id,
+        'spanId': span.span_id,
+        'parentSpanId': span.parent_id or '',
+        'name': span.name,
+        'kind': 'SPAN_KIND_SERVER' if span is metrics.root else 'SPAN_KIND_INTERNAL',
+        'startTimeUnixNano': span.start_time,
+        'endTimeUnixNano': span.end_time,
+        'attributes': span.attributes,
+        'status': {'code': 'STATUS_CODE_UNSET'},
+    }
+    if span.error:
+        record['status'] = {'code': 'STATUS_CODE_ERROR', 'message': span.error}
+    return record
@@ -1,11 +1,17 @@
 import functools
 from psycopg2 import IntegrityError
-from odoo import registry
 from odoo.http import request
+from werkzeug.wrappers import Response
 from odoo.exceptions import ValidationError
 
 from .http import JsonApiException, HttpJsonApiResponse, JsonApiResponse
 from .auth import ApiAuthentification
+from .log_buffer import request_log_buffer
+from .log_policy import DEFAULT_LOG_POLICY
+from .metrics import start_metrics, stop_metrics
+from .profiling import RequestProfiler, save_profiled_log
+from .prometheus import metrics_registry
+from .tracing import parse_traceparent, server_timing_header, write_trace
 
 
 # Log information of API Request
@@ -19,14 +25,47 @@ def api_route(auth=True, log_req=True):
             dbname = request.db
             # format of log_message. Ex: 'Method: http POST - 200: OK'
             log_message = 'Method: %s %s - ' + '%s %s' % (request_type, httprequest.method)
+            log_policy = DEFAULT_LOG_POLICY
+            handler_id = None
+            handler_name = None
+            profiler = None
+            failed = True
+            result = None
+            route = get_route()
+            trace_id, parent_id = parse_traceparent(
+                httprequest.headers.get('traceparent'))
+            metrics = start_metrics(trace_id, parent_id, {
+                'http.method': httprequest.method,
+                'http.route': route,
+                'http.target': api_endpoint,
+            })
+            metrics_registry.request_started(route, httprequest.method)
             try:
                 if auth:
-                    ApiAuthentification.auth_api_key()
-                result = func(*args, **kw)
-                if log_req:
+                    credentials = ApiAuthentification.auth_api_key()
+                    metrics.root.attributes['kuw_api.handler'] = credentials.name
+                    log_policy = credentials.log_policy
+                    handler_id = credentials.handler_id
+                    handler_name = credentials.name
+                    if log_req and credentials.profile_policy \
+                            and credentials.profile_policy.must_profile():
+                        profiler = RequestProfiler()
+                if profiler is None:
+                    result = func(*args, **kw)
+                else:
+                    with profiler:
+                        result = func(*args, **kw)
+                if isinstance(result, JsonApiResponse):
+                    # Encoded here to be part of the request span
+                    result.get_body()
+                failed = False
+                if log_req and (profiler is not None or log_policy.must_log(success=True)):
                     code = 200
                     msg = "OK"
-                    log_request(api_endpoint, str(kw), dbname, log_message % (code, msg), "success")
+                    metrics.response_size = get_response_size(result)
+                    payload = log_policy.format_payload(httprequest, kw)
+                    log_request(api_endpoint, payload, dbname, log_message % (code, msg), "success",
+                                handler_id=handler_id, metrics=metrics, profiler=profiler)
             except Exception as err:
                 if isinstance(err, JsonApiException):
                     code = 404
@@ -44,39 +83,85 @@ def api_route(auth=True, log_req=True):
                     code = 404
                     msg = 'Unexpected error occured'
                     hint = ""
+                metrics.root.error = repr(err)
 
                 if log_req:
-                    log_request(api_endpoint, str(kw), dbname, log_message % (code, err), 'fail')
+                    payload = log_policy.format_payload(httprequest, kw)
+                    log_request(api_endpoint, payload, dbname, log_message % (code, err), 'fail',
+                                handler_id=handler_id, metrics=metrics, profiler=profiler)
 
                 if request_type == 'http':
-                    return HttpJsonApiResponse.error_response(err, msg, hint=hint, code=code)
+                    result = HttpJsonApiResponse.error_response(err, msg, hint=hint, code=code)
                 else:
                     raise JsonApiException(msg=msg, hint=hint, code=code) from err
+            finally:
+                metrics_registry.request_finished(
+                    route, httprequest.method, handler_name,
+                    metrics.duration, error=failed)
+                stop_metrics()
+                add_trace(metrics, result)
             return result
         return wrapper
     return decorator
 
 
-# Add request information to database for tracking, analysis
-def log_request(api_endpoint, request_received, dbname, message, status='success'):
-    cr = registry(dbname).cursor()
-    cr.autocommit(True)
-    query = """INSERT INTO pcv_api_handler_log
-    (create_date, write_date, api_endpoint, request_received, state, message)
-    VALUES (now() at time zone 'UTC', now() at time zone 'UTC', %s, %s, %s, %s)"""
-    params = (api_endpoint, request_received, status, message,)
+def get_route():
+    """
+    Return the route pattern of the current request (e.g.
+    '/v1/api/items/<int:item_id>'), which keeps the metric labels bounded.
+    """
+    routing = getattr(getattr(request, 'endpoint', None), 'routing', None) or {}
+    routes = routing.get('routes')
+    return routes[0] if routes else request.httprequest.path
+
+
+def add_trace(metrics, result):
+    """
+    Send the timings of the request in the Server-Timing header of its
+    response and write its spans to the trace file, if any. The headers
+    of json routes are added by JsonRequestNew._json_response.
+    """
+    headers = [('Server-Timing', server_timing_header(metrics))]
+    if isinstance(result, Response):
+        result.headers.extend(headers)
+    else:
+        request.api_response_headers = headers
+    write_trace(metrics)
+
+
+def get_response_size(result):
+    """Return the number of bytes of the body of a route result, if known."""
+    if isinstance(result, JsonApiResponse):
+        return len(result.get_body())
+    if isinstance(result, Response):
+        return result.calculate_content_length()
+    return None
 
-    try:
-        cr.execute(query, params)
-    except Exception:
-        # retry
-        try:
-            cr = registry(dbname).cursor()
-            cr.autocommit(True)
-            cr.execute(query, params)
-        except Exception:
-            cr.close()
-    finally:
-        cr.close()
 
+# Add request information to database for tracking, analysis.
+# The entry is written asynchronously by the request log buffer, except
+# for profiled requests which are written with their profile right away.
+def log_request(api_endpoint, request_received, dbname, message, status='success',
+                handler_id=None, metrics=None, profiler=None):
+    vals = {
+        'api_endpoint': api_endpoint,
+        'request_received': request_received,
+        'state': status,
+        'message': message,
+        'api_handler_id': handler_id,
+    }
+    if metrics is not None:
+        vals.update({
+            'duration': metrics.duration * 1000,
+            'auth_duration': metrics.durations.get('auth', 0.0) * 1000,
+            'search_duration': metrics.durations.get('search', 0.0) * 1000,
+            'serialize_duration': metrics.durations.get('serialize', 0.0) * 1000,
+            'query_count': metrics.query_count,
+            'response_size': metrics.response_size,
+            'row_count': metrics.row_count,
+        })
+    if profiler is not None:
+        save_profiled_log(dbname, vals, profiler)
+    else:
+        request_log_buffer.append(dbname, vals)
     return True
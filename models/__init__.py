@@ -1,6 +1,8 @@
 from . import pcv_api_handler
 from . import pcv_api_handler_log
 from . import base
+from . import api_cache
+from . import pcv_api_tombstone
 from . import res_partner
 from . import product_template
 from . import pos_order
@@ -0,0 +1,131 @@
+import functools
+import logging
+
+from psycopg2 import sql
+from odoo import models, api, tools
+
+_logger = logging.getLogger(__name__)
+
+
+def _bump_generations(cr, sequences):
+    # Run after the commit, on the cursor of the transaction: nextval is
+    # not transactional, no other connection is needed
+    try:
+        with cr.savepoint(flush=False):
+            cr.execute("""
+                SELECT nextval(s::regclass) FROM unnest(%s::text[]) AS s
+                WHERE to_regclass(s) IS NOT NULL
+            """, (sorted(sequences),))
+    except Exception:
+        _logger.exception('Could not invalidate the API response cache')
+
+
+class ApiCacheMixin(models.AbstractModel):
+    """
+    Makes the GET responses of a model cacheable by get_record. Each model
+    keeps a generation number in a PostgreSQL sequence, increased after
+    the commit of any transaction which created, updated or deleted some
+    of its records. Sequences are not transactional and never lock, and
+    reading one is enough for every worker to know its cached responses
+    are outdated.
+
+    The responses hold the data of other models as well, the nested
+    fields for instance: `_api_cache_depends` lists them, so that their
+    changes outdate the responses too. A response reading a model which
+    is not listed is not cached.
+    """
+    _name = 'pcv.api.cache.mixin'
+    _description = 'API Response Cache'
+
+    _api_response_cache = True
+    # Other models whose data the responses hold: related and computed
+    # fields which are not stored, translations... The comodels of the
+    # fields of the query are added by get_record.
+    _api_cache_depends = ()
+
+    def init(self):
+        super(ApiCacheMixin, self).init()
+        if self._abstract:
+            return
+        for model_name in (self._name,) + tuple(self._api_cache_depends):
+            if model_name in self.env:
+                self.env[model_name]._create_api_cache_sequence()
+
+
+class Base(models.AbstractModel):
+    """Tracks the changes of the models read by the cached API responses."""
+    _inherit = 'base'
+
+    def _get_api_cache_sequence(self):
+        return '%s_api_cache_seq' % self._table
+
+    def _create_api_cache_sequence(self):
+        sequence = self._get_api_cache_sequence()
+        self._cr.execute(sql.SQL('CREATE SEQUENCE IF NOT EXISTS {}').format(
+            sql.Identifier(sequence)))
+        # A sequence never called has no value to read
+        self._cr.execute('SELECT nextval(%s)', (sequence,))
+
+    @api.model
+    @tools.ormcache()
+    def _get_api_cache_tracked_models(self):
+        """Names of the models whose changes outdate cached responses."""
+        model_names = set()
+        for model_class in self.pool.models.values():
+            if model_class._api_response_cache and not model_class._abstract:
+                model_names.add(model_class._name)
+                model_names.update(model_class._api_cache_depends)
+        return frozenset(model_names)
+
+    @api.model
+    def _get_api_cache_generation(self, model_names):
+        """
+        Return the generations of the models `model_names`, or None if one
+        of them has none yet.
+        """
+        sequences = [
+            self.env[model_name]._get_api_cache_sequence()
+            for model_name in model_names
+        ]
+        self._cr.execute("""
+            SELECT pg_sequence_last_value(to_regclass(s))
+            FROM unnest(%s::text[]) WITH ORDINALITY AS t(s, i)
+            ORDER BY i
+        """, (sequences,))
+        generation = tuple(row[0] for row in self._cr.fetchall())
+        if None in generation:
+            return None
+        return generation
+
+    def _invalidate_api_cache(self):
+        if self._name not in self._get_api_cache_tracked_models():
+            return
+        # Once per transaction, after its commit: a worker reading the
+        # new generation before the commit would cache the old data.
+        cr = self.env.cr
+        sequences = cr.postcommit.data.setdefault('kuw_api.cache_sequences', set())
+        if not sequences:
+            cr.postcommit.add(functools.partial(_bump_generations, cr, sequences))
+        sequences.add(self._get_api_cache_sequence())
+
+    @api.model
+    def _create(self, data_list):
+        records = super(Base, self)._create(data_list)
+        self._invalidate_api_cache()
+        return records
+
+    def write(self, vals):
+        # Also the many2many fields, which are not written by _write()
+        res = super(Base, self).write(vals)
+        self._invalidate_api_cache()
+        return res
+
+    def _write(self, vals):
+        # Also the stored computed fields, recomputed by _write()
+        res = super(Base, self)._write(vals)
+        self._invalidate_api_cache()
+        return res
+
+    def unlink(self):
+        self._invalidate_api_cache()
+        return super(Base, self).unlink()
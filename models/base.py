@@ -1,11 +1,39 @@
+import base64
+import hashlib
 import json
 import math
 import logging
+from datetime import date, datetime, timedelta
+from psycopg2 import sql
 from odoo import models, fields, api, exceptions, registry
+from odoo.http import request
+from odoo.osv import expression
 from schema import SchemaError
-from ..controllers.serializers import Serializer
+from ..controllers.serializers import Serializer, X2MANY_TYPES
+from ..controllers.query import compile_client_query, get_model_fields
 from ..controllers.exceptions import QueryFormatError
-from ..controllers.http import JsonApiResponse, HttpJsonApiResponse
+from ..controllers.encoders import encode_json
+from ..controllers.http import JsonApiResponse, HttpJsonApiResponse, get_response_mimetype
+from ..controllers.metrics import measure, set_row_count
+from ..controllers.response_cache import response_cache
+from .pcv_api_tombstone import TOMBSTONE_RETENTION_DAYS
+
+# Page size of the cursor pagination when the client does not send one
+KEYSET_DEFAULT_PAGE_SIZE = 100
+# Order of the records sent by the `since` mode
+SINCE_ORDER = 'write_date asc'
+# Seconds the `since` mode waits before sending a change: write dates are
+# the start time of their transaction, a transaction committed after a
+# sync can have written records before the time this sync reached
+SINCE_SAFETY_LAG = 60
+# Number of records fetched at once from the server-side cursor of the
+# streaming mode
+STREAM_CHUNK_SIZE = 1000
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# Layouts of the records sent by get_record, chosen by the `format`
+# parameter: a list of objects, or the field names once and a list of
+# arrays of values
+RESPONSE_FORMATS = ('records', 'columnar')
 
 
 class Base(models.AbstractModel):
@@ -15,11 +43,26 @@ class Base(models.AbstractModel):
     """
     _inherit = 'base'
 
+    # Whether get_record caches the responses, see pcv.api.cache.mixin
+    _api_response_cache = False
+    # Other models whose data the cached responses hold
+    _api_cache_depends = ()
+    # Whether the deletions are kept, see pcv.api.tombstone.mixin
+    _api_tombstones = False
+
     # created_by_api = fields.Boolean()
 
     @api.model
-    def get_record(self, query, params, default_order='', default_filter=[]):
+    def get_record(self, query, params, default_order='', default_filter=[],
+                   allowed_query=None):
         """
+        `allowed_query` lets the client choose its fields with a `query`
+        parameter (ex: {id, product_id{name}}) or a `fields` parameter
+        (ex: id,product_id{name}), within the fields of `allowed_query`.
+
+        With `format=columnar` the records are sent as their field names
+        in `columns` and their values in `rows`, in the same order:
+        {"columns": ["id", "name"], "rows": [[1, "A"], [2, "B"]]}
         """
         if "order" in params:
             order = params["order"]
@@ -31,54 +74,281 @@ class Base(models.AbstractModel):
         else:
             filters = default_filter
 
+        # The cache key holds the query texts, the client query is in the
+        # parameters
+        cache_key = self._get_api_cache_key(
+            query, params, default_order, default_filter)
+        query = self._get_api_query(query, params, allowed_query)
+
+        columnar = self._is_api_columnar(params)
+        stream = self._is_api_stream(params)
+        # The changes sent by the `since` mode depend on the time as well,
+        # streams are not kept
+        cacheable = "since" not in params and not stream
+
+        models_read = cacheable and self._get_api_query_models(query)
+        generation = None
+        if self._api_response_cache and cacheable \
+                and set(models_read) <= self._get_api_cache_tracked_models():
+            generation = self._get_api_cache_generation(models_read)
+
+        # The generations cover every model the response reads. Otherwise
+        # the write date and count of the records matching the filter only
+        # cover the model itself, and the keyset pages never count them.
+        validators = {}
+        if generation:
+            validators = {'etag': self._get_api_etag(cache_key, generation)}
+        elif self._log_access and cacheable and "cursor" not in params \
+                and models_read == (self._name,):
+            validators = self._get_api_validators(filters, cache_key)
+        if validators and self._is_api_not_modified(**validators):
+            set_row_count(0)
+            return HttpJsonApiResponse.not_modified_response(**validators)
+
+        if generation:
+            cached = response_cache.get(self._name, cache_key, generation)
+            if cached is not None:
+                set_row_count(cached.row_count)
+                return HttpJsonApiResponse.body_response(
+                    cached.body, etag=cached.etag)
+
+        if stream:
+            return HttpJsonApiResponse.stream_response(
+                self._stream_records(
+                    query, order, filters, params.get("limit"), columnar),
+                NDJSON_MIMETYPE)
+
+        if not generation:
+            return self._get_api_response(
+                query, params, order, filters, columnar, validators)[0]
+
+        # The generation is read before the snapshot of the data: a
+        # transaction committed in between increases it after its commit,
+        # so the response cached here is outdated at once rather than
+        # kept under the new generation. This request has read data
+        # already, the records are read in a new snapshot.
+        with self.pool.cursor() as cr:
+            response, row_count = self.with_env(self.env(cr=cr))._get_api_response(
+                query, params, order, filters, columnar, validators)
+        response_cache.set(
+            cache_key, generation, response.get_data(), row_count,
+            validators['etag'])
+        return response
+
+    @api.model
+    def _get_api_response(self, query, params, order, filters, columnar, validators):
+        """Return the response of get_record with its number of records."""
+        if "since" in params:
+            records, page_info = self._search_since_page(params, filters)
+        elif "cursor" in params:
+            records, page_info = self._search_keyset_page(
+                params, order, filters)
+        else:
+            records, page_info = self._search_offset_page(
+                params, order, filters)
+
+        set_row_count(len(records))
         try:
-            records = self.search(filters, order=order)
-        except Exception as err:
-            raise exceptions.ValidationError(err)
+            serializer = Serializer(records, query, many=True)
+            data = serializer.columnar_data if columnar else serializer.data
+        except (SyntaxError, QueryFormatError) as e:
+            raise exceptions.ValidationError(str(e))
 
-        prev_page = None
-        next_page = None
-        total_page_number = 1
-        current_page = 1
+        res = {"count": len(records)}
+        res.update(page_info)
+        if columnar:
+            res.update(data)
+        else:
+            res["result"] = data
+        response = HttpJsonApiResponse.success_response(res, **validators)
+        return response, len(records)
 
-        if "page_size" in params:
-            page_size = int(params["page_size"])
-            count = len(records)
-            total_page_number = math.ceil(count / page_size)
+    @api.model
+    def _get_api_query_models(self, query):
+        """
+        Return the names of the models whose data a response to `query`
+        holds: this one, its `_api_cache_depends` and the comodels of the
+        fields of the query.
+        """
+        try:
+            query_plan = Serializer(self.browse(), query).get_query_plan()
+        except (SyntaxError, QueryFormatError) as e:
+            raise exceptions.ValidationError(str(e))
 
-            if "page" in params:
-                current_page = int(params["page"])
-            else:
-                current_page = 1  # Default page Number
-            start = page_size * (current_page - 1)
-            stop = current_page * page_size
-            records = records[start:stop]
-            next_page = current_page + 1 \
-                if 0 < current_page + 1 <= total_page_number \
-                else None
-            prev_page = current_page - 1 \
-                if 0 < current_page - 1 <= total_page_number \
-                else None
+        model_names = [self._name]
+        model_names.extend(self._api_cache_depends)
+        plans = [(self.browse(), query_plan)]
+        while plans:
+            rec, plan = plans.pop()
+            fields_info = get_model_fields(rec)
+            try:
+                field_plans = plan.get_fields(rec)
+            except LookupError as e:
+                raise exceptions.ValidationError(str(e))
+            for field in field_plans:
+                field_info = fields_info[field.name]
+                # The ids of the one2many and many2many fields change with
+                # their comodel as well
+                if field.nested or field_info.type in X2MANY_TYPES:
+                    model_names.append(field_info.comodel_name)
+                if field.nested:
+                    plans.append((
+                        self.env[field_info.comodel_name].browse(), field.nested))
+
+        return tuple(sorted(set(model_names)))
 
-        if "limit" in params:
-            limit = int(params["limit"])
-            records = records[:limit]
+    @api.model
+    def _get_api_query(self, query, params, allowed_query):
+        """
+        Return the plan of the query sent by the client in the `query` or
+        `fields` parameter, restricted to `allowed_query`. Without any,
+        return the query of the endpoint.
+        """
+        if not allowed_query:
+            return query
+        if params.get("query"):
+            client_query = params["query"]
+        elif params.get("fields"):
+            client_query = '{%s}' % params["fields"]
+        else:
+            return query
+        try:
+            return compile_client_query(client_query, allowed_query)
+        except (SyntaxError, QueryFormatError) as e:
+            raise exceptions.ValidationError(str(e))
 
+    @api.model
+    def _is_api_stream(self, params):
+        """Whether the client asks for the NDJSON stream of all the records."""
+        if params.get("stream") in ("1", "true"):
+            return True
+        return bool(request) and any(
+            mimetype == NDJSON_MIMETYPE
+            for mimetype, quality in request.httprequest.accept_mimetypes)
+
+    @api.model
+    def _is_api_columnar(self, params):
+        """Whether the client asks for the columnar format, see get_record."""
+        response_format = params.get("format") or RESPONSE_FORMATS[0]
+        if response_format not in RESPONSE_FORMATS:
+            raise exceptions.ValidationError(
+                "Unknown format '%s', expected one of: %s" % (
+                    response_format, ', '.join(RESPONSE_FORMATS)))
+        return response_format == 'columnar'
+
+    @api.model
+    def _stream_records(self, query, order, filters, limit=None, columnar=False):
+        """
+        Return a generator of the records matching `filters` as NDJSON, one
+        serialized record per line, which runs once the request is over
+        in its own cursor. The ids come from a server-side cursor by
+        chunks of STREAM_CHUNK_SIZE and the record cache is emptied after
+        each chunk, so the memory used does not depend on the number of
+        records. In the columnar format the first line is the field names,
+        {"columns": [...]}, and each record is the array of its values.
+        """
         try:
-            serializer = Serializer(records, query, many=True)
-            data = serializer.data
+            # Errors are raised now, while they can still be answered
+            query = Serializer(self.browse(), query, many=True).get_query_plan()
+            if columnar:
+                header = encode_json({"columns": Serializer.serialize_columns(
+                    self.browse(), query)[0]}) + b'\n'
+            ids_query = self._search(
+                filters, order=order, limit=limit and int(limit))
+            query_str, query_params = ids_query.select()
         except (SyntaxError, QueryFormatError) as e:
             raise exceptions.ValidationError(str(e))
+        except Exception as err:
+            raise exceptions.ValidationError(err)
 
-        res = {
-            "count": len(records),
-            "prev": prev_page,
-            "current": current_page,
-            "next": next_page,
-            "total_pages": total_page_number,
-            "result": data
-        }
-        return HttpJsonApiResponse.success_response(res)
+        dbname = self._cr.dbname
+        uid = self.env.uid
+        context = dict(self.env.context)
+        model_name = self._name
+
+        def generate():
+            if columnar:
+                yield header
+            with registry(dbname).cursor() as cr:
+                model = api.Environment(cr, uid, context)[model_name]
+                with cr._cnx.cursor('kuw_api_stream') as ids_cursor:
+                    ids_cursor.execute(query_str, query_params)
+                    while True:
+                        rows = ids_cursor.fetchmany(STREAM_CHUNK_SIZE)
+                        if not rows:
+                            break
+                        records = model.browse([row[0] for row in rows])
+                        serializer = Serializer(records, query, many=True)
+                        if columnar:
+                            data = serializer.columnar_data['rows']
+                        else:
+                            data = serializer.data
+                        yield b''.join(
+                            encode_json(values) + b'\n' for values in data)
+                        model.invalidate_cache()
+
+        return generate()
+
+    @api.model
+    def _get_api_validators(self, filters, cache_key):
+        """
+        Return the ETag of a GET response of a model whose changes are
+        not tracked by pcv.api.cache.mixin, from the last write date and the
+        number of the records matching `filters`, read by one aggregate
+        query. Any create, write or delete in the matching records changes
+        one of them; the changes of other models do not, get_record only
+        sends it for the responses reading this model alone.
+
+        No Last-Modified date is sent: the last write date does not change
+        when a record is deleted or leaves the filter, a client sending it
+        back in If-Modified-Since would keep these records.
+        """
+        try:
+            with measure('validate'):
+                self._flush_search(filters, fields=['write_date'])
+                query = self._where_calc(filters)
+                self._apply_ir_rules(query, 'read')
+                from_clause, where_clause, where_params = query.get_sql()
+                self._cr.execute(
+                    'SELECT max("%s".write_date), count(1) FROM %s WHERE %s' % (
+                        self._table, from_clause, where_clause or 'TRUE'),
+                    where_params)
+                last_modified, count = self._cr.fetchone()
+        except Exception as err:
+            raise exceptions.ValidationError(err)
+
+        return {'etag': self._get_api_etag(cache_key, (last_modified, count))}
+
+    @api.model
+    def _get_api_etag(self, cache_key, version):
+        """The ETag of the response of `cache_key` for the data `version`."""
+        return hashlib.sha1(repr((cache_key, version)).encode()).hexdigest()
+
+    @api.model
+    def _is_api_not_modified(self, etag):
+        """Whether the If-None-Match header of the request matches `etag`."""
+        if not request:
+            return False
+        if_none_match = request.httprequest.if_none_match
+        return bool(if_none_match) and if_none_match.contains_weak(etag)
+
+    def _get_api_cache_key(self, query, params, default_order, default_filter):
+        """
+        Key of a GET response in the response cache: the request and
+        everything the records and their rendering depend on.
+        """
+        return (
+            self._cr.dbname,
+            self._name,
+            query,
+            tuple(sorted(params.items())),
+            default_order,
+            repr(default_filter),
+            self.env.uid,
+            tuple(self.env.companies.ids),
+            self.env.lang,
+            get_response_mimetype(),
+        )
 
     @api.model
     def post_record(self, post, rules=None, overwrite={}, data_key=None, query=None, allow_partial=False):
@@ -112,7 +382,8 @@ class Base(models.AbstractModel):
                 cr = registry(self._cr.dbname).cursor()
                 self = self.with_env(self.env(cr=cr))
             try:
-                record = self.with_context({"from_api": True}).create(vd)
+                with measure('create'):
+                    record = self.with_context({"from_api": True}).create(vd)
                 created.append(self._serialise_response(record, query))
             except Exception as e:
 
@@ -129,6 +400,7 @@ class Base(models.AbstractModel):
                     cr.commit()
                     cr.close()
 
+        set_row_count(len(created))
         result, msg, http_code = self._prepare_response_post(created, error, allow_partial)
         return JsonApiResponse(result=result, msg=msg, http_code=http_code)
 
@@ -185,7 +457,8 @@ class Base(models.AbstractModel):
                     (6, 0, validated_data[field])]  # Replace operation
             else:
                 pass
-        self.with_context({"from_api": True}).write(validated_data)
+        with measure('write'):
+            self.with_context({"from_api": True}).write(validated_data)
 
         result = self._serialise_response(self, query)
 
@@ -246,6 +519,276 @@ class Base(models.AbstractModel):
 
         return "%s / %s" % (base_error_msg, linker.join(base_info_message))
 
+    @api.model
+    def _search_offset_page(self, params, order, filters):
+        prev_page = None
+        next_page = None
+        total_page_number = 1
+        current_page = 1
+        offset = 0
+        limit = None
+
+        if "page_size" in params:
+            page_size = int(params["page_size"])
+            try:
+                with measure('search'):
+                    count = self.search_count(filters)
+            except Exception as err:
+                raise exceptions.ValidationError(err)
+            total_page_number = math.ceil(count / page_size)
+
+            if "page" in params:
+                current_page = int(params["page"])
+            else:
+                current_page = 1  # Default page Number
+            # Let the database skip and cut the rows of the other pages
+            offset = max(page_size * (current_page - 1), 0)
+            limit = page_size
+            next_page = current_page + 1 \
+                if 0 < current_page + 1 <= total_page_number \
+                else None
+            prev_page = current_page - 1 \
+                if 0 < current_page - 1 <= total_page_number \
+                else None
+
+        if "limit" in params:
+            limit = min(int(params["limit"]), limit or math.inf)
+
+        try:
+            with measure('search'):
+                records = self.search(
+                    filters, offset=offset, limit=limit, order=order)
+        except Exception as err:
+            raise exceptions.ValidationError(err)
+
+        page_info = {
+            "prev": prev_page,
+            "current": current_page,
+            "next": next_page,
+            "total_pages": total_page_number,
+        }
+        return records, page_info
+
+    @api.model
+    def _search_keyset_page(self, params, order, filters):
+        """
+        Seek pagination: the cursor holds the sort key of the last record
+        sent, the next page starts right after it whatever its depth.
+        An empty cursor starts from the first record.
+        """
+        order_spec = self._get_keyset_order_spec(order)
+        order = ', '.join('%s %s' % key for key in order_spec)
+        page_size = int(
+            params.get("page_size") or params.get("limit")
+            or KEYSET_DEFAULT_PAGE_SIZE)
+
+        domain = list(filters)
+        if params["cursor"]:
+            values = self._decode_cursor(params["cursor"], order)
+            domain = expression.AND([
+                domain, self._get_keyset_domain(order_spec, values)])
+
+        try:
+            # One extra row tells whether there is a next page
+            with measure('search'):
+                records = self.search(
+                    domain, limit=page_size + 1, order=order)
+        except Exception as err:
+            raise exceptions.ValidationError(err)
+
+        next_cursor = None
+        if len(records) > page_size:
+            records = records[:page_size]
+            values = self._get_keyset_values(records[-1], order_spec)
+            next_cursor = self._encode_cursor(order, values)
+
+        return records, {"next_cursor": next_cursor}
+
+    @api.model
+    def _search_since_page(self, params, filters):
+        """
+        Delta synchronization: the records created or updated after the
+        `since` cursor, by (write_date, id), and the ids of the records
+        deleted after it when the model keeps tombstones. An empty cursor
+        (or 0) starts a full synchronization. The `next_since` cursor
+        returned is sent back by the next call, `has_more` tells whether
+        changes are left.
+        """
+        if not self._log_access:
+            raise exceptions.ValidationError(
+                'The since mode is not available on this model')
+        order_spec = self._get_keyset_order_spec(SINCE_ORDER)
+        cursor_order = 'since: ' + ', '.join('%s %s' % key for key in order_spec)
+        page_size = int(
+            params.get("page_size") or params.get("limit")
+            or KEYSET_DEFAULT_PAGE_SIZE)
+        horizon = (self.env.cr.now() - timedelta(seconds=SINCE_SAFETY_LAG)
+                   ).isoformat(' ')
+
+        domain = expression.AND([filters, [
+            ('write_date', '<=', self._get_keyset_domain_value('write_date', horizon)),
+        ]])
+        if params["since"] and params["since"] != "0":
+            cursor = self._decode_cursor(params["since"], cursor_order)
+            try:
+                record_values, deletion_values = cursor
+            except (TypeError, ValueError):
+                raise exceptions.ValidationError('Invalid cursor')
+            if record_values:
+                domain = expression.AND([
+                    domain, self._get_keyset_domain(order_spec, record_values)])
+            retention_limit = datetime.utcnow() - timedelta(
+                days=TOMBSTONE_RETENTION_DAYS)
+            if deletion_values and deletion_values[0] < str(retention_limit):
+                raise exceptions.ValidationError(
+                    'The cursor is older than the %s days deletions are kept, '
+                    'a full synchronization is needed' % TOMBSTONE_RETENTION_DAYS)
+        else:
+            # A full synchronization has nothing to delete
+            record_values, deletion_values = None, [horizon, 0]
+
+        try:
+            with measure('search'):
+                records = self.search(
+                    domain, limit=page_size + 1, order=SINCE_ORDER + ', id asc')
+        except Exception as err:
+            raise exceptions.ValidationError(err)
+        has_more = len(records) > page_size
+        records = records[:page_size]
+        if records:
+            record_values = self._get_keyset_values(records[-1], order_spec)
+
+        deleted = []
+        if self._api_tombstones:
+            deleted, deletion_values, more_deleted = self.env[
+                'pcv.api.tombstone'].sudo()._read_deletions(
+                    self._name, deletion_values, horizon, page_size)
+            has_more = has_more or more_deleted
+
+        next_since = self._encode_cursor(
+            cursor_order, [record_values, deletion_values])
+        return records, {
+            "deleted": deleted,
+            "next_since": next_since,
+            "has_more": has_more,
+        }
+
+    @api.model
+    def _get_keyset_order_spec(self, order):
+        """
+        Parse an order clause into [(field, direction)], always ending on
+        the id so that the sort key is unique.
+        """
+        order_spec = []
+        for order_part in (order or '').split(','):
+            order_part = order_part.strip().split()
+            if not order_part:
+                continue
+            if len(order_part) > 2 or (
+                    len(order_part) == 2
+                    and order_part[1].lower() not in ('asc', 'desc')):
+                raise exceptions.ValidationError(
+                    "Invalid order '%s' for cursor pagination"
+                    % ' '.join(order_part))
+            field_name = order_part[0]
+            direction = order_part[1].lower() if len(order_part) == 2 \
+                else 'asc'
+            field = self._fields.get(field_name)
+            # The seek condition is built on the raw column value, so the
+            # ORM must sort on that same value.
+            if not field or not field.store or not field.column_type \
+                    or field.type in ('many2one', 'boolean') \
+                    or field.translate:
+                raise exceptions.ValidationError(
+                    "Field '%s' can not be used to order with a cursor"
+                    % field_name)
+            order_spec.append((field_name, direction))
+            if field_name == 'id':
+                break
+        else:
+            order_spec.append(('id', 'asc'))
+        return order_spec
+
+    @api.model
+    def _get_keyset_values(self, record, order_spec):
+        field_names = [field_name for field_name, _ in order_spec]
+        self.flush(field_names)
+        self._cr.execute(
+            sql.SQL('SELECT {} FROM {} WHERE id = %s').format(
+                sql.SQL(', ').join(map(sql.Identifier, field_names)),
+                sql.Identifier(self._table)),
+            [record.id])
+        values = []
+        for field_name, value in zip(field_names, self._cr.fetchone()):
+            if isinstance(value, datetime):
+                # Keep the microseconds, the next page must start right
+                # after this exact value
+                value = value.isoformat(' ')
+            elif isinstance(value, date):
+                value = self._fields[field_name].to_string(value)
+            values.append(value)
+        return values
+
+    @api.model
+    def _get_keyset_domain(self, order_spec, values):
+        """
+        Domain of the records sorted strictly after `values`, following the
+        PostgreSQL default of NULLS LAST when ascending, NULLS FIRST when
+        descending.
+        """
+        if len(values) != len(order_spec):
+            raise exceptions.ValidationError('Invalid cursor')
+
+        domains = []
+        equal_domain = []
+        for (field_name, direction), value in zip(order_spec, values):
+            value = self._get_keyset_domain_value(field_name, value)
+            if direction == 'asc' and value is None:
+                after = expression.FALSE_DOMAIN
+            elif direction == 'asc':
+                after = ['|', (field_name, '>', value),
+                         (field_name, '=', False)]
+            elif value is None:
+                after = [(field_name, '!=', False)]
+            else:
+                after = [(field_name, '<', value)]
+            domains.append(expression.AND([equal_domain, after]))
+            equal_domain = expression.AND([
+                equal_domain,
+                [(field_name, '=', False if value is None else value)],
+            ])
+        return expression.OR(domains)
+
+    @api.model
+    def _get_keyset_domain_value(self, field_name, value):
+        """
+        The datetimes of a cursor keep their microseconds, which the ORM
+        does not parse from a string: they are compared as datetimes.
+        """
+        if isinstance(value, str) and self._fields[field_name].type == 'datetime':
+            try:
+                return datetime.fromisoformat(value)
+            except ValueError:
+                raise exceptions.ValidationError('Invalid cursor')
+        return value
+
+    @api.model
+    def _encode_cursor(self, order, values):
+        cursor = json.dumps({"order": order, "values": values})
+        return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+    @api.model
+    def _decode_cursor(self, cursor, order):
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            values = cursor["values"]
+        except Exception:
+            raise exceptions.ValidationError('Invalid cursor')
+        if cursor.get("order") != order:
+            raise exceptions.ValidationError(
+                'The cursor was created for another order')
+        return values
+
     @api.model
     def _serialise_response(self, record, query):
         if query:
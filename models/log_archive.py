@@ -0,0 +1,103 @@
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+
+from odoo import fields
+from odoo.tools import config
+
+from ..controllers.log_policy import decode_payload
+
+ARCHIVE_DIRECTORY = 'kuw_api_logs'
+# Columns of pcv_api_handler_log kept in the archive, create_date first
+ARCHIVE_FIELDS = [
+    'create_date', 'api_endpoint', 'request_received', 'state', 'message',
+    'api_handler_id', 'duration', 'auth_duration', 'search_duration',
+    'serialize_duration', 'query_count', 'response_size', 'row_count',
+    'profiled',
+]
+
+
+def get_archive_directory(dbname):
+    return os.path.join(config.filestore(dbname), ARCHIVE_DIRECTORY)
+
+
+def get_archive_path(dbname, day):
+    """Archive file of the logs of one day: <filestore>/kuw_api_logs/YYYY/MM/YYYY-MM-DD.ndjson.gz"""
+    return os.path.join(
+        get_archive_directory(dbname),
+        day.strftime('%Y'),
+        day.strftime('%m'),
+        day.strftime('%Y-%m-%d') + '.ndjson.gz',
+    )
+
+
+def write_archive(dbname, rows, handler_names=None):
+    """
+    Append log rows (tuples ordered as ARCHIVE_FIELDS) to the archive
+    file of their day, with the name of their API key from
+    `handler_names` {handler id: name}. Each call adds a gzip member to
+    the files, which gzip readers read as one stream.
+    """
+    handler_names = handler_names or {}
+    rows_by_day = {}
+    for row in rows:
+        rows_by_day.setdefault(row[0].date(), []).append(row)
+
+    for day, day_rows in rows_by_day.items():
+        path = get_archive_path(dbname, day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(path, 'at', encoding='utf-8') as archive:
+            for row in day_rows:
+                vals = dict(zip(ARCHIVE_FIELDS, row))
+                vals['create_date'] = fields.Datetime.to_string(
+                    vals['create_date'])
+                vals['api_handler_name'] = handler_names.get(
+                    vals['api_handler_id'])
+                archive.write(json.dumps(vals) + '\n')
+
+
+def read_archive(dbname, date_from, date_to, api_endpoint=None, state=None):
+    """
+    Yield the archived logs of the days from `date_from` to `date_to`
+    included, optionally filtered on a part of the endpoint and on the
+    state, with their payload decoded. Files are read line by line.
+    """
+    day = date_from
+    while day <= date_to:
+        path = get_archive_path(dbname, day)
+        day += timedelta(days=1)
+        if not os.path.exists(path):
+            continue
+        with gzip.open(path, 'rt', encoding='utf-8') as archive:
+            for line in archive:
+                vals = json.loads(line)
+                if state and vals['state'] != state:
+                    continue
+                if api_endpoint and api_endpoint not in vals['api_endpoint']:
+                    continue
+                # Archives written before some columns were added
+                for field_name in ARCHIVE_FIELDS:
+                    vals.setdefault(field_name, None)
+                vals.setdefault('api_handler_name', None)
+                vals['request_received'] = decode_payload(
+                    vals['request_received'])
+                yield vals
+
+
+def purge_archive(dbname, before):
+    """Remove the archive files of the days before `before`, return their number."""
+    directory = get_archive_directory(dbname)
+    removed = 0
+    for root, dirs, files in os.walk(directory):
+        for file_name in files:
+            try:
+                day = datetime.strptime(
+                    file_name, '%Y-%m-%d.ndjson.gz').date()
+            except ValueError:
+                continue
+            if day < before:
+                os.remove(os.path.join(root, file_name))
+                removed += 1
+    return removed
+
@@ -1,7 +1,33 @@
 
 import hashlib
+import time
 import uuid
-from odoo import models, fields, api
+from collections import namedtuple
+from odoo import models, fields, api, tools, SUPERUSER_ID
+from odoo.tools import config
+from odoo.http import request
+
+from ..controllers.auth import ApiAuthentification
+from ..controllers.http import http, JsonApiException, HttpJsonApiResponse
+from ..controllers.log_policy import LogPolicy
+from ..controllers.profiling import ProfilePolicy
+from ..controllers.prometheus import metrics_registry
+
+# Seconds an API key stays in the authentication cache without being read
+# again from the database. Any change on the handlers clears the cache of
+# every worker right away.
+API_KEY_CACHE_TTL = 300
+
+# Comma separated addresses allowed to scrape /v1/api/metrics without an
+# API key, none by default. Behind a reverse proxy they are only known
+# with the proxy_mode option.
+METRICS_ALLOWED_IPS_PARAM = 'kuw_api.metrics_allowed_ips'
+
+ApiKeyCredentials = namedtuple(
+    'ApiKeyCredentials',
+    ['handler_id', 'name', 'uid', 'active', 'expire_date', 'log_policy',
+     'profile_policy'],
+)
 
 
 class ApiHandler(models.Model):
@@ -24,12 +50,43 @@ class ApiHandler(models.Model):
         compute='_compute_credentials',
         store=True,
         tracking=True,
+        index=True,
     )
     expire_date = fields.Datetime(string='Expiration date')
     encrypt_salt = fields.Char(
         string='Encript Salt',
         default=_default_encrypt_salt,
     )
+    log_payload = fields.Selection([
+        ('full', 'Full'),
+        ('hash', 'Hash only'),
+        ('none', 'Not stored'),
+    ], string='Logged Payload', default='full', required=True)
+    log_payload_max_size = fields.Integer(
+        'Max Logged Payload Size',
+        help='Maximum number of bytes of the payload stored in the logs, '
+             '0 for no limit.',
+    )
+    log_success_rate = fields.Float(
+        'Logged Success Rate',
+        default=1.0,
+        help='Part of the successful requests which are logged, '
+             'between 0 and 1. Failed requests are always logged.',
+    )
+    log_compress = fields.Boolean(
+        'Compress Logged Payload',
+        help='Store the payload zlib compressed in the logs.',
+    )
+    profile_rate = fields.Float(
+        'Profiled Rate',
+        help='Part of the requests which are profiled, between 0 and 1. '
+             'The profile and the SQL queries of the request are attached '
+             'to its log entry.',
+    )
+    profile_until = fields.Datetime(
+        'Profile Until',
+        help='Date after which the requests are not profiled anymore.',
+    )
 
     @api.depends('user_id', 'encrypt_salt')
     def _compute_credentials(self):
@@ -43,3 +100,106 @@ class ApiHandler(models.Model):
     def button_generate_new_key(self):
         self.ensure_one()
         self.write({'encrypt_salt': uuid.uuid4().hex})
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super(ApiHandler, self).create(vals_list)
+        self._clear_api_key_cache()
+        return records
+
+    def write(self, vals):
+        res = super(ApiHandler, self).write(vals)
+        self._clear_api_key_cache()
+        return res
+
+    def unlink(self):
+        res = super(ApiHandler, self).unlink()
+        self._clear_api_key_cache()
+        return res
+
+    def _clear_api_key_cache(self):
+        # Once the change is done, and again after the commit: until then
+        # a request of another thread still reads the old credentials and
+        # could put them back in the cache.
+        self.clear_caches()
+        cr = self.env.cr
+        if not cr.postcommit.data.get('kuw_api.clear_api_key_cache'):
+            cr.postcommit.data['kuw_api.clear_api_key_cache'] = True
+            cr.postcommit.add(self.clear_caches)
+
+    @api.model
+    def _get_api_key_credentials(self, api_key):
+        """
+        Return the ApiKeyCredentials of the handler owning `api_key`,
+        or None if there is none. Served from the registry cache, which
+        clear_caches() invalidates in all the workers.
+        """
+        ttl_bucket = int(time.time() // API_KEY_CACHE_TTL)
+        return self.sudo()._read_api_key_credentials(api_key, ttl_bucket)
+
+    @api.model
+    @tools.ormcache('api_key', 'ttl_bucket')
+    def _read_api_key_credentials(self, api_key, ttl_bucket):
+        handler = self.with_context(active_test=False).search(
+            [('incoming_api_key', '=', api_key)],
+            order='active desc, id',
+            limit=1,
+        )
+        if not handler:
+            return None
+        if handler.root_user:
+            uid = SUPERUSER_ID
+        else:
+            uid = handler.user_id.id
+        log_policy = LogPolicy(
+            handler.log_payload,
+            handler.log_payload_max_size,
+            handler.log_success_rate,
+            handler.log_compress,
+        )
+        profile_policy = None
+        if handler.profile_rate > 0:
+            profile_policy = ProfilePolicy(
+                handler.profile_rate, handler.profile_until)
+        return ApiKeyCredentials(
+            handler.id, handler.name, uid, handler.active,
+            handler.expire_date, log_policy, profile_policy)
+
+
+class MetricsAPI(http.Controller):
+
+    @http.route(
+        '/v1/api/metrics',
+        type='http',
+        auth='public',
+        methods=['GET'],
+        csrf=False,
+    )
+    def getMetrics(self, **params):
+        """
+        Prometheus metrics of the API requests of all the workers. Open to
+        the addresses of the kuw_api.metrics_allowed_ips parameter, the
+        other clients need an API key. A request forwarded by a proxy
+        always needs a key without the proxy_mode option, its address
+        being the one of the proxy.
+        """
+        allowed_ips = request.env['ir.config_parameter'].sudo().get_param(
+            METRICS_ALLOWED_IPS_PARAM) or ''
+        httprequest = request.httprequest
+        allowed = httprequest.remote_addr in [
+            ip.strip() for ip in allowed_ips.split(',') if ip.strip()]
+        if allowed and not config['proxy_mode'] \
+                and 'X-Forwarded-For' in httprequest.headers:
+            allowed = False
+        if not allowed:
+            try:
+                ApiAuthentification.auth_api_key()
+            except JsonApiException as err:
+                return HttpJsonApiResponse.error_response(
+                    err, err.msg, hint=err.hint, code=err.code)
+
+        return http.Response(
+            metrics_registry.render(),
+            status=200,
+            content_type='text/plain; version=0.0.4; charset=utf-8',
+        )
@@ -1,41 +1,206 @@
+import itertools
 import logging
+import time
 from datetime import datetime, timedelta
-from odoo import models, fields, api
+from odoo import models, fields, api, tools
+
+from . import log_archive
+from ..controllers.log_policy import decode_payload
 
 _logger = logging.getLogger(__name__)
 
+# Bytes of payloads and messages deleted at once when the purge archives
+# the rows, which are all read in memory
+LOG_ARCHIVE_BATCH_BYTES = 64 * 1024 * 1024
+# Pages summarized together by the BRIN index on create_date: small
+# ranges keep the pages shared by two days, after reuse, few
+LOG_BRIN_PAGES_PER_RANGE = 32
+
 
 class ApiHandlerLogs(models.Model):
+    """
+    Append-only table written in batches by the request log buffer, kept
+    without mail features nor access log columns to stay cheap to insert
+    and to vacuum.
+
+    The heap is not kept in date order: the space freed by the purges is
+    reused by new rows anywhere. Rows inserted together still fill the
+    same pages, so a BRIN index on create_date, in small page ranges,
+    finds the pages of a day for the purge and the archive; the btree
+    index serves the ordered reads of the views.
+    """
     _name = 'pcv.api.handler.log'
-    _inherit = ['mail.thread', 'mail.activity.mixin']
     _description = 'API Handle Logs'
     _rec_name = 'api_endpoint'
     _order = 'create_date DESC'
+    _log_access = False
 
+    create_date = fields.Datetime(
+        'Created on',
+        default=fields.Datetime.now,
+        readonly=True,
+        index=True,
+    )
     api_endpoint = fields.Char('API Endpoint', required=True)
     request_received = fields.Text('Request Received')
+    request_payload = fields.Text(
+        'Request Payload',
+        compute='_compute_request_payload',
+    )
     state = fields.Selection([
         ('success', 'Success'),
         ('fail', 'Fail'),
     ], string='Status', default='success')
     message = fields.Text('Message')
+    api_handler_id = fields.Many2one(
+        'pcv.api.handler',
+        string='API Key',
+        ondelete='set null',
+        readonly=True,
+    )
+    duration = fields.Float(
+        'Duration (ms)', readonly=True, group_operator='avg')
+    auth_duration = fields.Float(
+        'Authentication (ms)', readonly=True, group_operator='avg')
+    search_duration = fields.Float(
+        'Search (ms)', readonly=True, group_operator='avg')
+    serialize_duration = fields.Float(
+        'Serialization (ms)', readonly=True, group_operator='avg')
+    query_count = fields.Integer(
+        'SQL Queries', readonly=True, group_operator='avg')
+    response_size = fields.Integer('Response Size (bytes)', readonly=True)
+    row_count = fields.Integer('Rows', readonly=True)
+    profiled = fields.Boolean('Profiled', readonly=True)
+    profile_attachment_ids = fields.One2many(
+        'ir.attachment',
+        'res_id',
+        string='Profile',
+        domain=[('res_model', '=', 'pcv.api.handler.log')],
+        readonly=True,
+    )
+
+    @api.depends('request_received')
+    def _compute_request_payload(self):
+        for rec in self:
+            rec.request_payload = decode_payload(rec.request_received)
+
+    def init(self):
+        tools.create_index(
+            self._cr,
+            'pcv_api_handler_log_state_api_endpoint_index',
+            self._table,
+            ['state', 'api_endpoint'],
+        )
+        # Summarized by autovacuum as the table grows, see the docstring
+        self._cr.execute("""
+            CREATE INDEX IF NOT EXISTS pcv_api_handler_log_create_date_brin_index
+            ON pcv_api_handler_log USING brin (create_date)
+            WITH (pages_per_range = %s, autosummarize = on)
+        """ % LOG_BRIN_PAGES_PER_RANGE)
 
     @api.model
-    def autovacuum(self, days=10, batch=1000):
+    def autovacuum(self, days=10, batch=10000, time_budget=900, auto_commit=True,
+                   archive=True, archive_days=365):
+        """
+        Delete the logs older than `days` days with set-based SQL deletes
+        of `batch` rows, each one committed. The run stops after
+        `time_budget` seconds, the next run continues the purge.
+        With `archive`, the deleted rows are first appended to the
+        compressed archive of their day, which is kept `archive_days` days;
+        the rows are then read, so a delete also stops at
+        LOG_ARCHIVE_BATCH_BYTES of payloads.
+        """
         _logger.info('Launching API log cleaning')
-        sudo = self.sudo()
-        record_to_delete = sudo.get_record_to_delete(days=days, limit=batch)
-        while record_to_delete:
-            record_to_delete.unlink()
-            record_to_delete = None
-            sudo.flush()
-            record_to_delete = sudo.get_record_to_delete(
-                days=days, limit=batch)
-
-        _logger.info('API log cleaning done!')
+        limit_date = datetime.now() - timedelta(days=days)
+        deadline = time.monotonic() + time_budget
+        cr = self.env.cr
+        self.flush()
+
+        deleted = 0
+        handler_index = log_archive.ARCHIVE_FIELDS.index('api_handler_id')
+        if archive:
+            # The first rows up to the bytes limit, one at least. The sizes
+            # are read from the TOAST headers, without decompression.
+            selection = """
+                SELECT ctid FROM (
+                    SELECT ctid, size, sum(size) OVER (ROWS UNBOUNDED PRECEDING) AS total
+                    FROM (
+                        SELECT ctid, coalesce(octet_length(request_received), 0)
+                            + coalesce(octet_length(message), 0) AS size
+                        FROM pcv_api_handler_log
+                        WHERE create_date < %%s
+                        LIMIT %%s
+                    ) expired
+                ) batch
+                WHERE total - size < %s
+            """ % LOG_ARCHIVE_BATCH_BYTES
+            returning = ', '.join(log_archive.ARCHIVE_FIELDS)
+        else:
+            selection = """
+                SELECT ctid FROM pcv_api_handler_log
+                WHERE create_date < %s
+                LIMIT %s
+            """
+            returning = '1'
+        while True:
+            cr.execute("""
+                DELETE FROM pcv_api_handler_log
+                WHERE ctid = ANY(ARRAY(%s))
+                RETURNING %s
+            """ % (selection, returning), (limit_date, batch))
+            rows = cr.fetchall()
+            if archive and rows:
+                handler_ids = list({
+                    row[handler_index] for row in rows if row[handler_index]})
+                cr.execute(
+                    'SELECT id, name FROM pcv_api_handler WHERE id = ANY(%s)',
+                    (handler_ids,))
+                # The rows are only deleted once archived
+                log_archive.write_archive(cr.dbname, rows, dict(cr.fetchall()))
+            deleted += len(rows)
+            if auto_commit:
+                cr.commit()
+            if not rows:
+                break
+            _logger.info('API log cleaning: %s rows deleted', deleted)
+            if time.monotonic() > deadline:
+                _logger.info(
+                    'API log cleaning stopped after %s seconds, '
+                    'it will continue on the next run', time_budget)
+                break
+
+        self.invalidate_cache()
+        # Profiles attached to the deleted logs
+        cr.execute("""
+            SELECT a.id FROM ir_attachment a
+            WHERE a.res_model = %s AND NOT EXISTS (
+                SELECT 1 FROM pcv_api_handler_log l WHERE l.id = a.res_id
+            )
+        """, (self._name,))
+        attachment_ids = [row[0] for row in cr.fetchall()]
+        if attachment_ids:
+            self.env['ir.attachment'].sudo().browse(attachment_ids).unlink()
+        if archive:
+            removed = log_archive.purge_archive(
+                cr.dbname, (datetime.now() - timedelta(days=archive_days)).date())
+            if removed:
+                _logger.info('API log cleaning: %s archive files removed', removed)
+        _logger.info('API log cleaning done! %s rows deleted', deleted)
         return True
 
-    def get_record_to_delete(self, days=10, limit=1000):
-        return self.search([(
-            'create_date',
-            '<', datetime.now() - timedelta(days=days))], limit=limit)
+    @api.model
+    def search_archive(self, date_from, date_to, api_endpoint=None, state=None, limit=80):
+        """
+        Return the archived logs from `date_from` to `date_to` (included),
+        filtered on a part of the endpoint and on the state, with their
+        payload decoded in `request_received`.
+        """
+        self.check_access_rights('read')
+        logs = log_archive.read_archive(
+            self.env.cr.dbname,
+            fields.Date.to_date(date_from),
+            fields.Date.to_date(date_to),
+            api_endpoint=api_endpoint,
+            state=state,
+        )
+        return list(itertools.islice(logs, limit))
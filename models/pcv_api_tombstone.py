@@ -0,0 +1,89 @@
+import logging
+from datetime import timedelta
+from odoo import models, fields, api, tools
+
+_logger = logging.getLogger(__name__)
+
+# Days the deletions are kept, a `since` cursor older than that needs a
+# full synchronization
+TOMBSTONE_RETENTION_DAYS = 90
+
+
+class ApiTombstone(models.Model):
+    """
+    Records deleted from the models exposed by the API, delivered to the
+    clients by the `since` mode of get_record. Written by plain SQL in
+    the transaction of the deletion.
+    """
+    _name = 'pcv.api.tombstone'
+    _description = 'API Deleted Record'
+    _order = 'deleted_at, id'
+    _log_access = False
+
+    res_model = fields.Char('Model', required=True, readonly=True)
+    res_id = fields.Integer('Record ID', required=True, readonly=True)
+    deleted_at = fields.Datetime(
+        'Deleted on',
+        required=True,
+        readonly=True,
+        default=fields.Datetime.now,
+    )
+
+    def init(self):
+        tools.create_index(
+            self._cr,
+            'pcv_api_tombstone_res_model_deleted_at_index',
+            self._table,
+            ['res_model', 'deleted_at', 'id'],
+        )
+
+    @api.model
+    def _record_deletions(self, model_name, ids):
+        # deleted_at is the transaction time, as the write_date of records
+        self._cr.execute("""
+            INSERT INTO pcv_api_tombstone (res_model, res_id, deleted_at)
+            SELECT %s, unnest(%s), now() AT TIME ZONE 'UTC'
+        """, (model_name, list(ids)))
+
+    @api.model
+    def _read_deletions(self, model_name, position, horizon, limit):
+        """
+        Return the ids of the records of `model_name` deleted after the
+        (deleted_at, id) `position` and at `horizon` at the latest, at most
+        `limit` of them, the new position and whether more are left.
+        """
+        self._cr.execute("""
+            SELECT id, res_id, deleted_at FROM pcv_api_tombstone
+            WHERE res_model = %s
+                AND (deleted_at, id) > (%s, %s)
+                AND deleted_at <= %s
+            ORDER BY deleted_at, id
+            LIMIT %s
+        """, (model_name, position[0], position[1], horizon, limit + 1))
+        rows = self._cr.fetchall()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            position = [rows[-1][2].isoformat(' '), rows[-1][0]]
+            return [row[1] for row in rows], position, True
+        # Everything up to the horizon is delivered
+        return [row[1] for row in rows], [horizon, 0], False
+
+    @api.autovacuum
+    def _gc_tombstones(self):
+        limit_date = fields.Datetime.now() - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+        self._cr.execute(
+            'DELETE FROM pcv_api_tombstone WHERE deleted_at < %s', (limit_date,))
+        _logger.info('API tombstones cleaning: %s rows deleted', self._cr.rowcount)
+
+
+class ApiTombstoneMixin(models.AbstractModel):
+    """Keeps a tombstone of the deleted records for the `since` mode of get_record."""
+    _name = 'pcv.api.tombstone.mixin'
+    _description = 'API Deleted Records'
+
+    _api_tombstones = True
+
+    def unlink(self):
+        if self:
+            self.env['pcv.api.tombstone']._record_deletions(self._name, self.ids)
+        return super(ApiTombstoneMixin, self).unlink()
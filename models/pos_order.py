@@ -1,8 +1,17 @@
+from odoo import models
 from odoo.http import request
 from ..controllers.http import http
 from ..controllers.utils import api_route
 
 
+class PosOrder(models.Model):
+    _name = 'pos.order'
+    _inherit = ['pos.order', 'pcv.api.cache.mixin', 'pcv.api.tombstone.mixin']
+    # Models read by the allowed query, see pcv.api.cache.mixin
+    _api_cache_depends = ('pos.order.line', 'res.partner', 'product.product',
+                          'product.template', 'ir.translation')
+
+
 class OrderAPI(http.Controller):
 
     @http.route(
@@ -19,6 +28,13 @@ class OrderAPI(http.Controller):
         authorize API Key and log request information.
         """
         query = '(id:order_id, name:order_name) {id, name}'
+        # Fields the client can choose with the query or fields parameter
+        allowed_query = """(id:order_id, name:order_name) {
+            id, name, date_order, amount_total, state,
+            partner_id{id, name},
+            lines{id, product_id{id, default_code, name}, qty, price_unit,
+                  price_subtotal}}
+        """
         default_order = 'id desc'
         return request.env['pos.order'].get_record(
-            query, params, default_order)
+            query, params, default_order, allowed_query=allowed_query)
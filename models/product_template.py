@@ -1,4 +1,5 @@
 from schema import Schema, Optional, Or
+from odoo import models
 from odoo.http import request
 from ..controllers.http import http
 from ..controllers.utils import api_route
@@ -6,6 +7,14 @@ from ..controllers.utils import api_route
 from .utils import transform_name
 
 
+class ProductTemplate(models.Model):
+    _name = 'product.template'
+    _inherit = ['product.template', 'pcv.api.cache.mixin', 'pcv.api.tombstone.mixin']
+    # Models read by the allowed query, see pcv.api.cache.mixin
+    _api_cache_depends = ('product.product', 'product.category', 'uom.uom',
+                          'ir.property', 'ir.translation')
+
+
 class ItemAPI(http.Controller):
 
     @http.route(
@@ -22,9 +31,14 @@ class ItemAPI(http.Controller):
         authorize API Key and log request information.
         """
         query = '(id:item_id, name:item_name) {id, name}'
+        # Fields the client can choose with the query or fields parameter
+        allowed_query = """(id:item_id, name:item_name) {
+            id, name, default_code, barcode, list_price, standard_price,
+            categ_id{id, name}, uom_id{id, name}}
+        """
         default_order = 'id desc'
         return request.env['product.template'].get_record(
-            query, params, default_order)
+            query, params, default_order, allowed_query=allowed_query)
 
     @http.route(
         '/v1/api/items/<int:item_id>',
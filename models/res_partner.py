@@ -1,4 +1,5 @@
 from schema import Schema, Optional, Or
+from odoo import models
 from odoo.http import request
 from ..controllers.http import http
 from ..controllers.utils import api_route
@@ -6,6 +7,13 @@ from ..controllers.utils import api_route
 from .utils import transform_name
 
 
+class ResPartner(models.Model):
+    _name = 'res.partner'
+    _inherit = ['res.partner', 'pcv.api.cache.mixin', 'pcv.api.tombstone.mixin']
+    # Models read by the allowed query, see pcv.api.cache.mixin
+    _api_cache_depends = ('res.country', 'ir.translation')
+
+
 class UserAPI(http.Controller):
 
     @http.route(
@@ -22,9 +30,14 @@ class UserAPI(http.Controller):
         authorize API Key and log request information.
         """
         query = '(id:customer_id, name:customer_name) {id, name}'
+        # Fields the client can choose with the query or fields parameter
+        allowed_query = """(id:customer_id, name:customer_name) {
+            id, name, ref, email, phone, mobile, vat, street, city, zip,
+            country_id{id, name, code}}
+        """
         default_order = 'id desc'
         return request.env['res.partner'].get_record(
-            query, params, default_order)
+            query, params, default_order, allowed_query=allowed_query)
 
     @http.route(
         '/v1/api/customers/<int:partner_id>',
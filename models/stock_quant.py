@@ -1,10 +1,59 @@
 from numpy import integer
 from schema import Schema, Optional, Or
+from odoo import models, api
 from odoo.http import request
 from ..controllers.http import http
 from ..controllers.utils import api_route
 
 
+class StockQuant(models.Model):
+    _name = 'stock.quant'
+    _inherit = ['stock.quant', 'pcv.api.cache.mixin', 'pcv.api.tombstone.mixin']
+    # Models read by the allowed query, see pcv.api.cache.mixin
+    _api_cache_depends = ('product.product', 'product.template', 'res.company',
+                          'res.partner', 'stock.location', 'ir.translation')
+
+    @api.model
+    def _merge_quants(self):
+        """
+        The duplicate quants are merged by plain SQL: keep the tombstones
+        of the deleted ones, and set the write date of the ones which got
+        their quantities, for the `since` mode and the response cache.
+        """
+        # Same groups as the merge, which keeps the first quant of each
+        self._cr.execute("""
+            SELECT min(id), array_agg(id)
+            FROM stock_quant
+            GROUP BY product_id, company_id, location_id, lot_id, package_id, owner_id
+            HAVING count(id) > 1
+        """)
+        groups = self._cr.fetchall()
+        res = super(StockQuant, self)._merge_quants()
+        if not groups:
+            return res
+
+        # The merge is rolled back on errors
+        duplicate_ids = [
+            quant_id for kept_id, quant_ids in groups
+            for quant_id in quant_ids if quant_id != kept_id]
+        self._cr.execute(
+            'SELECT id FROM stock_quant WHERE id = ANY(%s)', (duplicate_ids,))
+        deleted_ids = set(duplicate_ids) - {row[0] for row in self._cr.fetchall()}
+        if not deleted_ids:
+            return res
+        self.env['pcv.api.tombstone']._record_deletions(self._name, sorted(deleted_ids))
+        kept_ids = [
+            kept_id for kept_id, quant_ids in groups
+            if deleted_ids.intersection(quant_ids)]
+        self._cr.execute("""
+            UPDATE stock_quant SET write_date = now() AT TIME ZONE 'UTC', write_uid = %s
+            WHERE id = ANY(%s)
+        """, (self.env.uid, kept_ids))
+        self.invalidate_cache(['write_date', 'write_uid'], kept_ids)
+        self._invalidate_api_cache()
+        return res
+
+
 class InventoryAPI(http.Controller):
 
     @http.route(
@@ -33,9 +82,24 @@ class InventoryAPI(http.Controller):
                 location_id,
                 quantity}
         """
+        # Fields the client can choose with the query or fields parameter
+        allowed_query = """(
+            id:inventory_id,
+            product_id:product_id,
+            company_id:company_id,
+            location_id:location_id,
+            quantity:quantity)
+            {
+                id,
+                product_id{id, default_code, name},
+                company_id{id, name},
+                location_id{id, name, complete_name},
+                quantity,
+                reserved_quantity}
+        """
         default_order = 'id desc'
         return request.env['stock.quant'].get_record(
-            query, params, default_order)
+            query, params, default_order, allowed_query=allowed_query)
 
     @http.route(
         '/v1/api/inventory/<int:inventory_id>',
@@ -0,0 +1,4 @@
+from . import test_binary_codecs
+from . import test_model_fields_benchmark
+from . import test_parser
+from . import test_serializers
@@ -0,0 +1,243 @@
+import math
+from datetime import date, datetime
+
+from odoo.tests.common import BaseCase
+
+from ..controllers import binary_codecs
+from ..controllers.encoders import MEDIA_TYPES, encode_body
+
+# RFC 8949 Appendix A: (value, hex), the values encoded the same way
+CBOR_VECTORS = [
+    (0, '00'),
+    (1, '01'),
+    (10, '0a'),
+    (23, '17'),
+    (24, '1818'),
+    (25, '1819'),
+    (100, '1864'),
+    (1000, '1903e8'),
+    (1000000, '1a000f4240'),
+    (1000000000000, '1b000000e8d4a51000'),
+    (18446744073709551615, '1bffffffffffffffff'),
+    (18446744073709551616, 'c249010000000000000000'),
+    (-18446744073709551616, '3bffffffffffffffff'),
+    (-18446744073709551617, 'c349010000000000000000'),
+    (-1, '20'),
+    (-10, '29'),
+    (-100, '3863'),
+    (-1000, '3903e7'),
+    (1.1, 'fb3ff199999999999a'),
+    (1.0e+300, 'fb7e37e43c8800759c'),
+    (-4.1, 'fbc010666666666666'),
+    (False, 'f4'),
+    (True, 'f5'),
+    (None, 'f6'),
+    (b'', '40'),
+    (b'\x01\x02\x03\x04', '4401020304'),
+    ('', '60'),
+    ('a', '6161'),
+    ('IETF', '6449455446'),
+    ('"\\', '62225c'),
+    ('ü', '62c3bc'),
+    ('水', '63e6b0b4'),
+    ('\U00010151', '64f0908591'),
+    ([], '80'),
+    ([1, 2, 3], '83010203'),
+    ([1, [2, 3], [4, 5]], '8301820203820405'),
+    (list(range(1, 26)),
+     '98190102030405060708090a0b0c0d0e0f101112131415161718181819'),
+    ({}, 'a0'),
+    ({1: 2, 3: 4}, 'a201020304'),
+    ({'a': 1, 'b': [2, 3]}, 'a26161016162820203'),
+    (['a', {'b': 'c'}], '826161a161626163'),
+    ({'a': 'A', 'b': 'B', 'c': 'C', 'd': 'D', 'e': 'E'},
+     'a56161614161626142616361436164614461656145'),
+]
+
+# RFC 8949 Appendix A: (value, hex), the values encoded otherwise: the
+# floats are always sent in 64 bits, lengths are always definite, and
+# the other tags keep their value only
+CBOR_DECODE_VECTORS = [
+    (0.0, 'f90000'),
+    (-0.0, 'f98000'),
+    (1.0, 'f93c00'),
+    (1.5, 'f93e00'),
+    (65504.0, 'f97bff'),
+    (100000.0, 'fa47c35000'),
+    (3.4028234663852886e+38, 'fa7f7fffff'),
+    (5.960464477539063e-8, 'f90001'),
+    (0.00006103515625, 'f90400'),
+    (-4.0, 'f9c400'),
+    (math.inf, 'f97c00'),
+    (-math.inf, 'f9fc00'),
+    (math.inf, 'fa7f800000'),
+    (-math.inf, 'faff800000'),
+    (math.inf, 'fb7ff0000000000000'),
+    (-math.inf, 'fbfff0000000000000'),
+    (None, 'f7'),
+    ('2013-03-21T20:04:00Z', 'c074323031332d30332d32315432303a30343a30305a'),
+    (1363896240, 'c11a514b67b0'),
+    (1363896240.5, 'c1fb41d452d9ec200000'),
+    (b'\x01\x02\x03\x04', 'd74401020304'),
+    (b'dIETF', 'd818456449455446'),
+    (b'\x01\x02\x03\x04\x05', '5f42010243030405ff'),
+    ('streaming', '7f657374726561646d696e67ff'),
+    ([], '9fff'),
+    ([1, [2, 3], [4, 5]], '9f018202039f0405ffff'),
+    ([1, [2, 3], [4, 5]], '9f01820203820405ff'),
+    ([1, [2, 3], [4, 5]], '83018202039f0405ff'),
+    ([1, [2, 3], [4, 5]], '83019f0203ff820405'),
+    (list(range(1, 26)),
+     '9f0102030405060708090a0b0c0d0e0f101112131415161718181819ff'),
+    ({'a': 1, 'b': [2, 3]}, 'bf61610161629f0203ffff'),
+    (['a', {'b': 'c'}], '826161bf61626163ff'),
+    ({'Fun': True, 'Amt': -2}, 'bf6346756ef563416d7421ff'),
+]
+
+# Values of the MessagePack and CBOR round trips: every size of every type
+ROUND_TRIP_VALUES = [
+    None, True, False,
+    0, 1, 0x7f, 0x80, 0xff, 0x100, 0xffff, 0x10000, 0xffffffff,
+    0x100000000, 0xffffffffffffffff, 0x10000000000000000, 10 ** 100,
+    -1, -0x20, -0x21, -0x80, -0x81, -0x8000, -0x8001, -0x80000000,
+    -0x80000001, -0x8000000000000000, -0x8000000000000001, -10 ** 100,
+    0.0, -0.0, 1.5, -4.1, 1.0e+300, math.inf, -math.inf,
+    '', 'a', 'x' * 31, 'x' * 32, 'x' * 0xff, 'x' * 0x100, 'x' * 0x10000,
+    'ü水\U00010151', '\ud800',
+    b'', b'\x00' * 0xff, b'\x00' * 0x100, b'\x00' * 0x10000,
+    [], list(range(15)), list(range(16)), list(range(0x10000)),
+    {}, {str(i): i for i in range(15)}, {str(i): i for i in range(16)},
+    {str(i): i for i in range(0x10000)},
+    {'id': 1, 'name': 'A', 'lines': [{'id': 2, 'qty': 1.5}], 'parent': False,
+     1: None},
+]
+
+# Invalid data, besides the truncated values
+MSGPACK_MALFORMED = [
+    'c1',  # never used
+    'd90161ff',  # invalid UTF-8
+    '0000',  # extra data
+    '8190c0',  # unhashable key
+    'd40501',  # unknown extension type
+    'db' + 'ff' * 4,  # longer than the data
+    '91' * 100000 + 'c0',  # too deep
+]
+CBOR_MALFORMED = [
+    '1c',  # reserved argument
+    'ff',  # break outside of an indefinite length item
+    'f0',  # unassigned simple value
+    '6161ff',  # extra data
+    '61ff',  # invalid UTF-8
+    'a18001',  # unhashable key
+    'bf01ff',  # key without value
+    'df01ff',  # indefinite length tag
+    '7b' + 'ff' * 8,  # longer than the data
+    '81' * 100000 + 'f6',  # too deep
+]
+
+
+class TestBinaryCodecs(BaseCase):
+
+    def assertSameValue(self, result, value):
+        # 0.0 == -0.0 and math.nan != math.nan
+        self.assertEqual(repr(result), repr(value))
+
+    def test_msgpack_round_trip(self):
+        for value in ROUND_TRIP_VALUES:
+            with self.subTest(value=repr(value)[:50]):
+                data = binary_codecs.msgpack_dumps(value)
+                self.assertSameValue(binary_codecs.msgpack_loads(data), value)
+
+    def test_cbor_round_trip(self):
+        for value in ROUND_TRIP_VALUES:
+            with self.subTest(value=repr(value)[:50]):
+                data = binary_codecs.cbor_dumps(value)
+                self.assertSameValue(binary_codecs.cbor_loads(data), value)
+
+    def test_default(self):
+        """Other values are encoded as what `default` returns, tuples as lists."""
+        value = {'date': date(2020, 1, 2), 'ids': (1, 2)}
+        expected = {'date': '2020-01-02', 'ids': [1, 2]}
+        self.assertEqual(binary_codecs.msgpack_loads(
+            binary_codecs.msgpack_dumps(value)), expected)
+        self.assertEqual(binary_codecs.cbor_loads(
+            binary_codecs.cbor_dumps(value)), expected)
+
+    def test_msgpack_bignum(self):
+        self.assertEqual(
+            binary_codecs.msgpack_dumps(2 ** 64).hex(),
+            'c70902010000000000000000')
+        self.assertEqual(
+            binary_codecs.msgpack_dumps(-2 ** 64 - 1).hex(),
+            'c70903010000000000000000')
+        # Any extension size
+        self.assertEqual(binary_codecs.msgpack_loads(bytes.fromhex('d40201')), 1)
+        self.assertEqual(binary_codecs.msgpack_loads(bytes.fromhex('d50301ff')), -512)
+
+    def test_cbor_vectors(self):
+        for value, hex_data in CBOR_VECTORS:
+            with self.subTest(value=value):
+                data = bytes.fromhex(hex_data)
+                self.assertEqual(binary_codecs.cbor_dumps(value).hex(), hex_data)
+                self.assertSameValue(binary_codecs.cbor_loads(data), value)
+
+    def test_cbor_decode_vectors(self):
+        for value, hex_data in CBOR_DECODE_VECTORS:
+            with self.subTest(hex_data=hex_data):
+                self.assertSameValue(
+                    binary_codecs.cbor_loads(bytes.fromhex(hex_data)), value)
+        self.assertTrue(math.isnan(binary_codecs.cbor_loads(bytes.fromhex('f97e00'))))
+
+    def test_truncated(self):
+        """No part of a value is a value."""
+        for dumps, loads in [
+                (binary_codecs.msgpack_dumps, binary_codecs.msgpack_loads),
+                (binary_codecs.cbor_dumps, binary_codecs.cbor_loads)]:
+            for value in ROUND_TRIP_VALUES:
+                data = dumps(value)
+                # The last bytes, and a few of the headers
+                for length in set(range(min(len(data), 12))) | {len(data) - 1}:
+                    with self.subTest(loads=loads.__name__, value=repr(value)[:50],
+                                      length=length):
+                        with self.assertRaises(ValueError):
+                            loads(data[:length])
+        for hex_data in [hex_data for value, hex_data in CBOR_DECODE_VECTORS]:
+            data = bytes.fromhex(hex_data)
+            for length in range(len(data)):
+                with self.subTest(hex_data=hex_data, length=length):
+                    with self.assertRaises(ValueError):
+                        binary_codecs.cbor_loads(data[:length])
+
+    def test_malformed(self):
+        for loads, malformed in [
+                (binary_codecs.msgpack_loads, MSGPACK_MALFORMED),
+                (binary_codecs.cbor_loads, CBOR_MALFORMED)]:
+            for hex_data in malformed:
+                with self.subTest(loads=loads.__name__, hex_data=hex_data[:20]):
+                    with self.assertRaises(ValueError):
+                        loads(bytes.fromhex(hex_data))
+
+    def test_media_types(self):
+        """Every media type carries the values of the JSON, through the C packages too."""
+        value = {
+            'id': 1,
+            'big': 2 ** 70,
+            'negative_big': -2 ** 70,
+            'date': date(2020, 1, 2),
+            'datetime': datetime(2020, 1, 2, 3, 4, 5),
+            'amount': 1.5,
+            'lines': [{'name': '水', 'active': True, 'parent': None}],
+        }
+        expected = dict(value, date='2020-01-02', datetime='2020-01-02 03:04:05')
+        for mimetype, media_type in MEDIA_TYPES.items():
+            with self.subTest(mimetype=mimetype):
+                self.assertEqual(
+                    media_type.decode(encode_body(value, mimetype)), expected)
+
+    def test_media_types_malformed(self):
+        """The decoders of the request bodies raise ValueError, answered with 400."""
+        for mimetype, media_type in MEDIA_TYPES.items():
+            for data in [b'', b'\xc1\xff\x00', b'{"a": 1', b'\x82\x01']:
+                with self.subTest(mimetype=mimetype, data=data):
+                    with self.assertRaises(ValueError):
+                        media_type.decode(data)
@@ -0,0 +1,77 @@
+import logging
+import time
+
+from odoo.tests.common import TransactionCase, tagged
+
+from ..controllers.query import get_model_fields
+from ..controllers.serializers import Serializer
+
+_logger = logging.getLogger(__name__)
+
+# Partners serialized by the benchmark, created when the database has less
+BENCHMARK_RECORDS = 200
+
+
+@tagged('post_install', '-at_install', 'kuw_api_benchmark')
+class TestModelFieldsBenchmark(TransactionCase):
+    """
+    Timings of the field metadata lookups of a {*} query over res.partner:
+    one fields_get() per serialized cell as before get_model_fields, then
+    the cached mapping. Run with --test-tags kuw_api_benchmark.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestModelFieldsBenchmark, cls).setUpClass()
+        Partner = cls.env['res.partner']
+        missing = BENCHMARK_RECORDS - Partner.search_count([])
+        if missing > 0:
+            Partner.create([
+                {'name': 'API Benchmark %s' % i} for i in range(missing)])
+        cls.partners = Partner.search([], limit=BENCHMARK_RECORDS)
+        cls.field_names = [
+            field.name for field in
+            Serializer(cls.partners, '{*}').get_query_plan().get_fields(
+                cls.partners)
+        ]
+
+    def _time(self, function):
+        start = time.perf_counter()
+        result = function()
+        return time.perf_counter() - start, result
+
+    def test_field_types(self):
+        def with_fields_get():
+            return [
+                [rec.fields_get(field_name)[field_name]['type']
+                 for field_name in self.field_names]
+                for rec in self.partners
+            ]
+
+        def with_model_fields():
+            types = []
+            for rec in self.partners:
+                fields_info = get_model_fields(rec)
+                types.append([
+                    fields_info[field_name].type
+                    for field_name in self.field_names
+                ])
+            return types
+
+        before, before_types = self._time(with_fields_get)
+        after, after_types = self._time(with_model_fields)
+        self.assertEqual(before_types, after_types)
+        _logger.info(
+            'Field types of {*} over %s res.partner (%s fields): '
+            'fields_get %.3fs, get_model_fields %.3fs (x%.0f)',
+            len(self.partners), len(self.field_names), before, after,
+            before / max(after, 1e-9))
+
+    def test_serialize_all_fields(self):
+        self.partners.invalidate_cache()
+        duration, data = self._time(
+            lambda: Serializer(self.partners, '{*}', many=True).data)
+        self.assertEqual(len(data), len(self.partners))
+        _logger.info(
+            'Serializer {*} over %s res.partner: %.3fs',
+            len(self.partners), duration)
@@ -0,0 +1,190 @@
+import logging
+import random
+import re
+import unittest
+
+from odoo.tests.common import BaseCase
+
+from ..controllers.exceptions import QueryFormatError
+from ..controllers.parser import Parser
+
+try:
+    import pypeg2
+except ImportError:
+    pypeg2 = None
+
+_logger = logging.getLogger(__name__)
+
+if pypeg2 is not None:
+    from .pypeg2_grammar import Parser as Pypeg2Parser
+else:
+    # Not a dependency of the module, see requirements-test.txt
+    _logger.warning(
+        'pypeg2 is not installed, the parser is not compared with the '
+        'former grammar: pip install -r requirements-test.txt')
+
+# Number of mutated queries compared with the pypeg2 grammar
+DIFFERENTIAL_CASES = 5000
+
+VALID_QUERIES = [
+    '{}',
+    '{*}',
+    '{id, name}',
+    '{ id , name }',
+    '{\n id,\n name\n}',
+    '{*, -id}',
+    '{-id, -name}',
+    '{id, partner_id{name, -x}}',
+    '{id, partner_id{*, -x}}',
+    '(limit: 10){a}',
+    "(a:'x y', b:\"z\"){*}",
+    '{a(x: 1){b}}',
+    '{lines(filter_func: filtered_lines){id, qty}}',
+    '{a{b{c{d}}}}',
+]
+
+SYNTAX_ERRORS = [
+    '',
+    'id',
+    '{',
+    '{id',
+    '{id name}',
+    '{id,}',
+    '{-}',
+    '{- id}',
+    '{}x',
+    '{id, name}}',
+    '{a{b}',
+    '(limit: 10)',
+    '(a:"x){b}',
+    '{a(b: 1, ){c}}',
+    '{\n id,\n name\n}x',
+]
+
+FORMAT_ERRORS = [
+    '{id, -name}',
+    '{a{b, -c}}',
+]
+
+MUTATION_TOKENS = list("{}(),:*-'\" \n") + [
+    'id', 'name', 'a', 'b_1', 'x', 'limit', '10', 'é']
+MUTATION_SEEDS = VALID_QUERIES + FORMAT_ERRORS
+
+
+def _parse(parser_class, query):
+    """The result of parsing `query`, in a comparable form."""
+    try:
+        return ('ok', parser_class(query).get_parsed())
+    except SyntaxError as e:
+        # The messages name the grammar classes by module
+        msg = re.sub(r"<class '[\w.]+\.(\w+)'>", r'\1', e.msg)
+        return ('syntax', msg, e.lineno, e.text, e.offset)
+    except QueryFormatError as e:
+        return ('format', str(e))
+
+
+def _mutate(rnd, query):
+    for i in range(rnd.randint(1, 3)):
+        pos = rnd.randint(0, len(query))
+        operation = rnd.random()
+        if operation < 0.4:
+            query = query[:pos] + rnd.choice(MUTATION_TOKENS) + query[pos:]
+        elif operation < 0.8:
+            query = query[:pos] + query[pos + 1:]
+        else:
+            query = query[:pos] + rnd.choice(MUTATION_TOKENS) + query[pos + 1:]
+    return query
+
+
+def _generate_queries(seed=0):
+    rnd = random.Random(seed)
+    for i in range(DIFFERENTIAL_CASES):
+        if rnd.random() < 0.5:
+            yield _mutate(rnd, rnd.choice(MUTATION_SEEDS))
+        else:
+            yield ''.join(
+                rnd.choice(MUTATION_TOKENS) for j in range(rnd.randint(0, 12)))
+
+
+class TestParser(BaseCase):
+
+    def test_parse(self):
+        self.assertEqual(Parser('{id, partner_id(limit: 5){*, -x}}').get_parsed(), {
+            'include': ['id', {'partner_id': {
+                'include': ['*'],
+                'exclude': ['x'],
+                'arguments': {'limit': '5'},
+            }}],
+            'exclude': [],
+            'arguments': {},
+        })
+
+    def test_format_errors(self):
+        for query in FORMAT_ERRORS:
+            with self.subTest(query=query):
+                with self.assertRaises(QueryFormatError):
+                    Parser(query).get_parsed()
+
+    def test_syntax_error_excerpt(self):
+        """The excerpt and offset point at the character where parsing stopped."""
+        cases = [
+            # query, text, offset
+            ('{id name}', '{id name}', 5),
+            ('{id, name}}', '{id, name}}', 11),
+            ('{\n id,\n name\n}x', '}x', 2),
+            ('{id, partner_id{name, -x,}}', 'artner_id{name, -x,}}', 20),
+            ('id', 'id', 1),
+            # At the end of a line
+            ('{-\nid}', '{-', 3),
+            ('{id name\n}', '{id name', 5),
+        ]
+        for query, text, offset in cases:
+            with self.subTest(query=query):
+                with self.assertRaises(SyntaxError) as context:
+                    Parser(query).get_parsed()
+                self.assertEqual(context.exception.text, text)
+                self.assertEqual(context.exception.offset, offset)
+
+
+@unittest.skipIf(
+    pypeg2 is None, 'pypeg2 is not installed, see requirements-test.txt')
+class TestParserDifferential(BaseCase):
+    """
+    The parser against the former pypeg2 grammar: same results, same
+    errors and messages. The SyntaxError excerpts differ on purpose:
+    pypeg2 placed them at the start of an enclosing or earlier element,
+    the parser at the character where it stopped.
+    """
+
+    def assertSameParse(self, query):
+        expected = _parse(Pypeg2Parser, query)
+        result = _parse(Parser, query)
+        # Result or error, and message
+        self.assertEqual(result[:2], expected[:2])
+        if result[0] == 'syntax':
+            lineno, text, offset = result[2:]
+            # The excerpt is a part of the line of the error
+            self.assertIn(text, query.split('\n')[lineno - 1])
+            self.assertTrue(1 <= offset <= len(text) + 1)
+
+    def test_valid_queries(self):
+        for query in VALID_QUERIES:
+            with self.subTest(query=query):
+                self.assertSameParse(query)
+
+    def test_errors(self):
+        for query in SYNTAX_ERRORS + FORMAT_ERRORS:
+            with self.subTest(query=query):
+                self.assertSameParse(query)
+
+    def test_mutated_queries(self):
+        for query in _generate_queries():
+            with self.subTest(query=query):
+                self.assertSameParse(query)
+
+    def test_excerpt_at_error_start(self):
+        """Both report the same excerpt for errors at the start of an element."""
+        for query in ['id', '{', '(a:"x){b}']:
+            with self.subTest(query=query):
+                self.assertEqual(
+                    _parse(Parser, query), _parse(Pypeg2Parser, query))
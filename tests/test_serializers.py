@@ -0,0 +1,161 @@
+from odoo.tests.common import TransactionCase, tagged
+
+from ..controllers.serializers import Serializer, convert_datetime
+
+
+@tagged('post_install', '-at_install')
+class TestSerializeMany(TransactionCase):
+    """
+    serialize_many reads the fields in batch: its output must stay the
+    one of serializing the records one by one with serialize().
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestSerializeMany, cls).setUpClass()
+        Partner = cls.env['res.partner']
+        categories = cls.env['res.partner.category'].create([
+            {'name': 'API Serializer B'}, {'name': 'API Serializer A'}])
+        country = cls.env.ref('base.be')
+        cls.company = Partner.create({
+            'name': 'API Serializer Company',
+            'is_company': True,
+            'country_id': country.id,
+            'date': '2021-03-04',
+            'category_id': [(6, 0, categories.ids)],
+        })
+        cls.partners = cls.company | Partner.create([
+            {'name': 'API Serializer Contact 2', 'parent_id': cls.company.id,
+             'date': '2021-05-06'},
+            {'name': 'API Serializer Contact 1', 'parent_id': cls.company.id,
+             'category_id': [(6, 0, categories[:1].ids)]},
+            {'name': 'API Serializer Alone'},
+        ])
+
+    def assertSameSerialization(self, records, query):
+        query_plan = Serializer(records, query).get_query_plan()
+        records.invalidate_cache()
+        expected = [Serializer.serialize(rec, query_plan) for rec in records]
+        records.invalidate_cache()
+        data = Serializer(records, query, many=True).data
+        self.assertEqual(data, expected)
+        records.invalidate_cache()
+        names, rows = Serializer.serialize_columns(records, query_plan)
+        self.assertEqual([dict(zip(names, row)) for row in rows], expected)
+        return data
+
+    def test_flat_fields(self):
+        """Dates, datetimes, many2one, one2many and many2many as ids."""
+        data = self.assertSameSerialization(
+            self.partners,
+            '{id, name, date, create_date, parent_id, child_ids, category_id, active}')
+        self.assertEqual(data[0]['date'], '2021-03-04')
+        self.assertEqual(
+            data[0]['create_date'],
+            convert_datetime(self.company.create_date))
+        self.assertEqual(data[1]['parent_id'], self.company.id)
+        self.assertEqual(data[3]['parent_id'], False)
+
+    def test_all_fields(self):
+        self.assertSameSerialization(
+            self.partners, '{*, -image_1920, -image_1024, -image_512}')
+
+    def test_nested_fields(self):
+        self.assertSameSerialization(
+            self.partners,
+            '{id, parent_id{id, name, date, country_id{name, code}}, '
+            'child_ids{id, name, category_id{name}}, category_id{*, -child_ids}}')
+
+    def test_aliases_and_filter_functions(self):
+        data = self.assertSameSerialization(
+            self.partners,
+            '(id:partner_id,name:partner_name,category_id:tags~sorted,'
+            'child_ids:contacts~sorted)'
+            '{id, name, category_id, child_ids{id, name}}')
+        self.assertEqual(
+            list(data[0]), ['partner_id', 'partner_name', 'tags', 'contacts'])
+        # In the order of the model, by display name
+        self.assertEqual(
+            [contact['name'] for contact in data[0]['contacts']],
+            ['API Serializer Contact 1', 'API Serializer Contact 2'])
+
+    def test_deleted_records(self):
+        """Records deleted after the search are left out."""
+        records = self.partners.browse(self.partners.ids)
+        deleted = self.partners[3]
+        deleted.unlink()
+        data = Serializer(records, '{id, name, parent_id{name}}', many=True).data
+        self.assertEqual(
+            [vals['id'] for vals in data], (self.partners - deleted).ids)
+        self.assertEqual(data, self.assertSameSerialization(
+            self.partners - deleted, '{id, name, parent_id{name}}'))
+
+    def test_empty_query(self):
+        self.assertEqual(self.assertSameSerialization(self.partners, '{}'), [{}] * 4)
+
+
+@tagged('post_install', '-at_install')
+class TestSerializeNestedQueries(TransactionCase):
+    """
+    The nested fields are loaded for the whole batch at once: the number
+    of queries grows with the depth of the query, not with the records.
+    Pickings and their moves have the shape of the orders and their lines.
+    """
+
+    QUERIES = [
+        '{id}',
+        '{id, move_lines}',
+        '{id, move_lines{product_id}}',
+        '{id, move_lines{product_id{name}}}',
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestSerializeNestedQueries, cls).setUpClass()
+        products = cls.env['product.product'].create([
+            {'name': 'API Serializer Product %s' % i, 'type': 'consu'}
+            for i in range(5)])
+        picking_type = cls.env.ref('stock.picking_type_out')
+        location = picking_type.default_location_src_id
+        location_dest = cls.env.ref('stock.stock_location_customers')
+
+        def create_pickings(count, lines):
+            return cls.env['stock.picking'].create([{
+                'picking_type_id': picking_type.id,
+                'location_id': location.id,
+                'location_dest_id': location_dest.id,
+                'move_lines': [(0, 0, {
+                    'name': product.name,
+                    'product_id': product.id,
+                    'product_uom': product.uom_id.id,
+                    'product_uom_qty': 1,
+                    'location_id': location.id,
+                    'location_dest_id': location_dest.id,
+                }) for product in products[:lines]],
+            } for i in range(count)])
+
+        cls.few_pickings = create_pickings(2, 1)
+        cls.many_pickings = create_pickings(20, 5)
+        cls.env['base'].flush()
+
+    def _count_queries(self, records, query):
+        # The first run fills the caches of the access rules and fields
+        Serializer(records, query, many=True).data
+        records.invalidate_cache()
+        start = self.cr.sql_log_count
+        Serializer(records, query, many=True).data
+        return self.cr.sql_log_count - start
+
+    def test_query_count(self):
+        counts = []
+        for query in self.QUERIES:
+            few = self._count_queries(self.few_pickings, query)
+            many = self._count_queries(self.many_pickings, query)
+            self.assertEqual(
+                many, few,
+                '%s: %s queries for 2 records, %s for 20' % (query, few, many))
+            counts.append(few)
+        # Each level of nesting loads its records once
+        self.assertEqual(counts, sorted(counts))
+        self.assertLess(counts[1], counts[2])
+        self.assertLess(counts[2], counts[3])